@@ -3,25 +3,29 @@ from connexion import NoContent
 from connexion.middleware import MiddlewarePosition
 from starlette.middleware.cors import CORSMiddleware
 from connexion import FlaskApp
-import json
 import logging
-import logging.config
 import yaml
 import os
-from pykafka import KafkaClient
+import time
 from pykafka.common import OffsetType
 from flask import jsonify, request
+from threading import Thread
+from event_index import EventIndex
+from kafka_pool import KafkaPool
+from event_common.event_stream import EventStream, EventStreamMiddleware
+from event_common.metrics import MetricsMiddleware
+from event_common.log_setup import setup_logging
+from event_common.codec import decode, message_type
+from prometheus_client import Counter, Gauge, Histogram
 
 
 SERVICE_NAME = "analyzer"
 
-# Load logging configuration from YAML
-with open("config/log_conf.yml", "r") as log_file:
-    log_config = yaml.safe_load(log_file)
-    log_config['handlers']['file']['filename'] = f'logs/{SERVICE_NAME}.log'
-    logging.config.dictConfig(log_config)
+# Load logging configuration from YAML; handlers write from a background thread
+setup_logging("config/log_conf.yml", f'logs/{SERVICE_NAME}.log')
 
 logger = logging.getLogger("basicLogger")
+event_logger = logging.getLogger("basicLogger.events")  # Sampled per-event messages
 
 # Load configuration from YAML
 with open("config/analyzer_conf.yml", "r") as f:
@@ -33,32 +37,136 @@ KAFKA_TOPIC = CONFIG["events"]["kafka"]["topic"]
 
 ################################################################
 
+# Shared Kafka client and lookup consumers for all request threads
+POOL_CONFIG = CONFIG["pool"]
+kafka_pool = KafkaPool(
+    KAFKA_HOST,
+    KAFKA_TOPIC,
+    size=POOL_CONFIG["size"],
+    acquire_timeout=POOL_CONFIG["acquire_timeout"],
+    health_check_interval=POOL_CONFIG["health_check_interval"]
+)
+
+# Event index built by a background consumer, checkpointed to disk if configured
+INDEX_CONFIG = CONFIG["index"]
+event_index = EventIndex(INDEX_CONFIG["filename"] if INDEX_CONFIG["persist"] else None,
+                         keep_offsets=INDEX_CONFIG["enabled"])
+
+# Hot-path metrics served at /metrics
+MESSAGES_INDEXED = Counter("kafka_messages_consumed_total", "Messages read from the events topic by the indexer")
+LOOKUP_LATENCY = Histogram("event_lookup_duration_seconds", "Time to fetch one event by index from Kafka")
+LOOKUPS = Counter("event_lookups_total", "Event lookups by index", ["event_type", "result"])
+INDEXED_EVENTS = Gauge("indexed_events", "Events the index can locate", ["event_type"])
+POOL_IN_USE = Gauge("kafka_pool_consumers_in_use", "Lookup consumers currently borrowed")
+for indexed_type in ("player", "server"):
+    INDEXED_EVENTS.labels(indexed_type).set_function(lambda t=indexed_type: event_index.counts()[t])
+POOL_IN_USE.set_function(lambda: kafka_pool.metrics()["in_use"])
+
+def seek_target(offset):
+    """pykafka resets to the last consumed offset, so step back one; -1 would mean LATEST"""
+    return offset - 1 if offset > 0 else OffsetType.EARLIEST
+
+def make_index_consumer():
+    """Create the indexer's consumer on the shared client, positioned at the checkpoint"""
+    topic = kafka_pool.topic()
+    consumer = topic.get_simple_consumer(
+        consumer_group=b"analyzer_group",
+        reset_offset_on_start=True,
+        auto_offset_reset=OffsetType.EARLIEST,
+        consumer_timeout_ms=1000
+    )
+
+    # Resume from the checkpoint instead of re-reading partitions that are already indexed
+    next_offsets = event_index.next_offsets()
+    if next_offsets:
+        consumer.reset_offsets([
+            (consumer.partitions[partition_id], seek_target(offset))
+            for partition_id, offset in next_offsets.items()
+            if partition_id in consumer.partitions
+        ])
+
+    logger.info(f"Event indexer started at offsets {next_offsets or 'earliest'}")
+    return consumer
+
+def index_events():
+    """Consume the topic in the background, recording each event's partition/offset"""
+    event_index.load()
+    consumer = None
+    last_save = time.monotonic()
+
+    while True:
+        try:
+            if consumer is None:
+                consumer = make_index_consumer()
+
+            msg = consumer.consume()
+            if msg is not None:
+                MESSAGES_INDEXED.inc()
+                try:
+                    event_type = message_type(msg.value)  # Binary messages are indexed from the header alone
+                except ValueError as e:
+                    logger.error("Skipping undecodable message at offset %s: %s", msg.offset, e)
+                    event_type = None
+                event_index.record(event_type, msg.partition_id, msg.offset)
+
+            if time.monotonic() - last_save >= INDEX_CONFIG["save_interval"]:
+                event_index.save()
+                consumer.commit_offsets()  # Mirror the checkpoint in the consumer group for lag tooling
+                last_save = time.monotonic()
+
+        except Exception as e:
+            logger.error(f"Event indexer lost its Kafka connection, reconnecting: {e}")
+            if consumer is not None:
+                try:
+                    consumer.stop()  # Otherwise its fetcher threads outlive it
+                except Exception:
+                    pass
+            consumer = None
+            time.sleep(POOL_CONFIG["reconnect_interval"])
+            try:
+                kafka_pool.reconnect()
+            except Exception as e:
+                logger.error(f"Kafka reconnect failed: {e}")
+
+def setup_index_thread():
+    index_thread = Thread(target=index_events)
+    index_thread.daemon = True
+    index_thread.start()
+
+def fetch_message(partition_id, offset):
+    """Seek a pooled consumer to a partition/offset and fetch that one message.
+
+    Pooled consumers read every partition, so messages already queued from
+    the others are skipped until the target partition's first message arrives.
+    """
+    deadline = time.monotonic() + POOL_CONFIG["lookup_timeout"]
+    with kafka_pool.consumer() as consumer:
+        consumer.reset_offsets([(consumer.partitions[partition_id], seek_target(offset))])
+        while True:
+            msg = consumer.consume()  # None once consumer_timeout_ms passes with nothing queued
+            if msg is None or msg.partition_id == partition_id:
+                break
+            if time.monotonic() >= deadline:
+                return None
+
+    if msg is None or msg.offset != offset:
+        return None
+    return decode(msg.value)
+
 def get_event_by_index(index, event_type):
     """Retrieve an event from Kafka based on its index in the queue."""
     try:
-        client = KafkaClient(hosts=KAFKA_HOST)
-        topic = client.topics[KAFKA_TOPIC.encode()]
-        consumer = topic.get_simple_consumer(reset_offset_on_start=True, consumer_timeout_ms=1000)
-        
-        current_index = -1  # Initialize current index to -1 to put it at the beginning
-
-        for msg in consumer:
-            if msg is None:
-                break  # No more messages in queue
-
-            message = msg.value.decode("utf-8")
-            data = json.loads(message)
-
-            # Check for event type
-            if (event_type == "player" and  data["type"] == "player_event") or \
-               (event_type == "server" and  data["type"] == "server_event"):
-                current_index += 1  # Increment index for the specific event type
-
-                if current_index == index:
-                    logger.info(f"Found {event_type} message at index {index}: {data}")
-                    return data, 200
-                
-        logger.warning(f"No {event_type} message found at index {index}")
+        location = event_index.locate(event_type, index)
+        with LOOKUP_LATENCY.time():
+            data = fetch_message(*location) if location is not None else None
+        LOOKUPS.labels(event_type, "found" if data is not None else "missing").inc()
+
+        if data is not None:
+            event_logger.info("Found %s message at index %s", event_type, index,
+                              extra={"trace_id": data['payload'].get('trace_id')})
+            return data, 200
+
+        event_logger.warning("No %s message found at index %s", event_type, index)
         return {"message": f"No {event_type} message at index {index}!"}, 404
 
     except Exception as e:
@@ -85,42 +193,33 @@ def get_server_event():
 
 ################################################################
 
+def event_statistics():
+    counts = event_index.counts()
+    return {
+        "num_player_events": counts["player"],
+        "num_server_events": counts["server"]
+    }
+
 def get_event_statistics():
     """API Endpoint: Retrieve statistics about events in Kafka."""
-    try:
-        client = KafkaClient(hosts=KAFKA_HOST)
-        topic = client.topics[KAFKA_TOPIC.encode()]
-        consumer = topic.get_simple_consumer(reset_offset_on_start=True, consumer_timeout_ms=1000)
-
-        num_player_events = 0
-        num_server_events = 0
-
-        for msg in consumer:
-            if msg is None:
-                break  # No more messages
-
-            message = msg.value.decode("utf-8")
-            data = json.loads(message)
-
-
-            if "payload" in data:
-                payload = data["payload"]
-                if "player_id" in payload:
-                    num_player_events += 1
-                elif "server_id" in payload:
-                    num_server_events += 1
-
-        stats = {
-            "num_player_events": num_player_events,
-            "num_server_events": num_server_events
-        }
-
-        logger.info(f"Kafka events tracked in the queue: {stats}")
-        return jsonify(stats), 200
-
-    except Exception as e:
-        logger.error(f"Error retrieving Kafka statistics: {e}")
-        return jsonify({"message": "Internal server error"}), 500
+    stats = event_statistics()
+
+    logger.debug(f"Kafka events tracked in the queue: {stats}")
+    return jsonify(stats), 200
+
+def get_pool_metrics():
+    """API Endpoint: Report the state of the shared Kafka client pool."""
+    return jsonify(kafka_pool.metrics()), 200
+
+# Dashboards subscribe here instead of polling GET /stats
+STREAM_CONFIG = CONFIG["stream"]
+stats_stream = EventStream(
+    event_statistics,
+    interval=STREAM_CONFIG["interval"],
+    keepalive=STREAM_CONFIG["keepalive"],
+    max_clients=STREAM_CONFIG["max_clients"],
+    queue_size=STREAM_CONFIG["queue_size"]
+)
 
 # Create the connexion app
 app = connexion.FlaskApp(__name__, specification_dir='')
@@ -132,9 +231,18 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(
+    EventStreamMiddleware,
+    position=MiddlewarePosition.BEFORE_EXCEPTION,
+    path="/stats/stream",
+    stream=stats_stream,
+)
+app.add_middleware(MetricsMiddleware, position=MiddlewarePosition.BEFORE_EXCEPTION)
 
 # Add the API specification (make sure your openapi.yml file is in place)
 app.add_api("ACIT3855-ProjectAnalyzer.yaml", strict_validation=True, validate_responses=True)
 
 if __name__ == "__main__":
+    kafka_pool.start_health_checks()
+    setup_index_thread()
     app.run(port=8110, host="0.0.0.0")
@@ -0,0 +1,165 @@
+import base64
+import json
+import logging
+import os
+import threading
+from array import array
+
+
+logger = logging.getLogger("basicLogger")
+
+# Kafka message types tracked by the index, keyed by the name used in the API
+EVENT_TYPES = {
+    "player": "player_event",
+    "server": "server_event"
+}
+
+class EventIndex:
+    """Maps the Nth event of each type to the Kafka partition and offset holding it.
+
+    Entries are kept in compact typed arrays so millions of events cost a few
+    bytes each, and the index can be checkpointed to disk incrementally and resumed.
+    Running per-type counts are kept alongside, so with keep_offsets=False the
+    index degrades to a counts-only tracker with a tiny checkpoint.
+    """
+
+    def __init__(self, filename=None, keep_offsets=True):
+        self.filename = filename
+        self.keep_offsets = keep_offsets
+        self._lock = threading.Lock()
+        self._counts = {event_type: 0 for event_type in EVENT_TYPES}
+        self._partitions = {event_type: array("i") for event_type in EVENT_TYPES}
+        self._offsets = {event_type: array("q") for event_type in EVENT_TYPES}
+        self._next_offsets = {}  # Partition id -> next offset to consume
+        self._saved_entries = {event_type: 0 for event_type in EVENT_TYPES}  # Entries already in the entries files
+        self._dirty = False
+
+    def record(self, message_type, partition_id, offset):
+        """Add a consumed message to the index, advancing the partition's position"""
+        with self._lock:
+            for event_type, type_name in EVENT_TYPES.items():
+                if message_type == type_name:
+                    self._counts[event_type] += 1
+                    if self.keep_offsets:
+                        self._partitions[event_type].append(partition_id)
+                        self._offsets[event_type].append(offset)
+                    break
+            self._next_offsets[partition_id] = offset + 1
+            self._dirty = True
+
+    def locate(self, event_type, index):
+        """Return (partition_id, offset) of the event at the given ordinal, or None"""
+        if not self.keep_offsets:
+            return None
+
+        with self._lock:
+            if index < 0 or index >= len(self._offsets[event_type]):
+                return None
+            return self._partitions[event_type][index], self._offsets[event_type][index]
+
+    def counts(self):
+        """Number of events of each type consumed so far"""
+        with self._lock:
+            return dict(self._counts)
+
+    def next_offsets(self):
+        """Per-partition offsets the background consumer should resume from"""
+        with self._lock:
+            return dict(self._next_offsets)
+
+    def _entries_path(self, event_type):
+        return f"{os.path.splitext(self.filename)[0]}.{event_type}.idx"
+
+    def save(self):
+        """Checkpoint the index to disk, appending only the entries recorded since the last checkpoint.
+
+        Each type's entries live in an append-only file of (partition, offset)
+        int64 pairs; the JSON checkpoint, replaced atomically, says how many of
+        them are valid. A crash between the two leaves extra entries past that
+        count, which load() ignores and the next save() overwrites.
+        """
+        if not self.filename:
+            return
+
+        with self._lock:
+            if not self._dirty:
+                return
+            state = {
+                "next_offsets": {str(p): o for p, o in self._next_offsets.items()},
+                "counts": dict(self._counts)
+            }
+            # Only the new tail is copied under the lock; recording carries on while it is written
+            tails = {}
+            if self.keep_offsets:
+                for event_type, offsets in self._offsets.items():
+                    saved = self._saved_entries[event_type]
+                    tails[event_type] = (saved, self._partitions[event_type][saved:], offsets[saved:])
+                    self._saved_entries[event_type] = len(offsets)
+                state["entries"] = dict(self._saved_entries)
+            self._dirty = False
+
+        try:
+            for event_type, (saved, partitions, offsets) in tails.items():
+                pairs = array("q", bytes(16 * len(offsets)))
+                pairs[0::2] = array("q", partitions)
+                pairs[1::2] = offsets
+                with open(self._entries_path(event_type), "ab") as f:
+                    f.truncate(16 * saved)  # Drop anything a crashed save appended past the last checkpoint
+                    pairs.tofile(f)
+
+            tmp_filename = f"{self.filename}.tmp"
+            with open(tmp_filename, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_filename, self.filename)
+        except OSError:
+            # Write the same tails again next time rather than leave a gap in the entries files
+            with self._lock:
+                for event_type, (saved, _, _) in tails.items():
+                    self._saved_entries[event_type] = saved
+                self._dirty = True
+            raise
+        logger.debug(f"Saved event index checkpoint: {state['next_offsets']}")
+
+    def _load_entries(self, event_type, entries):
+        """First `entries` (partition, offset) pairs of a type's entries file"""
+        pairs = array("q")
+        path = self._entries_path(event_type)
+        with open(path, "rb") as f:
+            pairs.fromfile(f, 2 * entries)  # Raises EOFError if the file is shorter than the checkpoint says
+        return array("i", pairs[0::2]), pairs[1::2]
+
+    def load(self):
+        """Restore a checkpoint written by save(), if there is one"""
+        if not self.filename or not os.path.exists(self.filename):
+            return
+
+        try:
+            with open(self.filename, "r") as f:
+                state = json.load(f)
+            counts = {t: int(state["counts"][t]) for t in EVENT_TYPES}
+            next_offsets = {int(p): o for p, o in state["next_offsets"].items()}
+            if self.keep_offsets and "partitions" in state:
+                # Checkpoint from before the entries files: the next save writes them out in full
+                partitions = {t: array("i", base64.b64decode(state["partitions"][t])) for t in EVENT_TYPES}
+                offsets = {t: array("q", base64.b64decode(state["offsets"][t])) for t in EVENT_TYPES}
+                saved_entries = {t: 0 for t in EVENT_TYPES}
+            elif self.keep_offsets:
+                saved_entries = {t: int(state["entries"][t]) for t in EVENT_TYPES}
+                loaded = {t: self._load_entries(t, saved_entries[t]) for t in EVENT_TYPES}
+                partitions = {t: entries[0] for t, entries in loaded.items()}
+                offsets = {t: entries[1] for t, entries in loaded.items()}
+        except (ValueError, KeyError, OSError, EOFError) as e:
+            # Includes a counts-only checkpoint when offsets are now wanted: rebuild from the start
+            logger.error(f"Ignoring unusable event index checkpoint {self.filename}: {e}")
+            return
+
+        with self._lock:
+            self._counts = counts
+            self._next_offsets = next_offsets
+            if self.keep_offsets:
+                self._partitions = partitions
+                self._offsets = offsets
+                self._saved_entries = saved_entries
+            self._dirty = "partitions" in state  # Rewrite an old-format checkpoint in the new layout
+
+        logger.info(f"Loaded event index checkpoint with {counts} events, resuming at offsets {next_offsets}")
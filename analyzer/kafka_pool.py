@@ -0,0 +1,178 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from pykafka import KafkaClient
+from pykafka.common import OffsetType
+
+
+logger = logging.getLogger("basicLogger")
+
+class PoolTimeout(Exception):
+    """Raised when no lookup consumer frees up within the acquire timeout"""
+
+class KafkaPool:
+    """One KafkaClient per process plus a bounded pool of lookup consumers.
+
+    Request threads borrow a consumer, seek and fetch, then hand it back, so
+    broker metadata discovery and consumer setup happen once rather than per
+    request. A background health check refreshes cluster metadata and rebuilds
+    the client and its consumers if the brokers stop answering.
+    """
+
+    def __init__(self, hosts, topic_name, size, acquire_timeout, health_check_interval):
+        self.hosts = hosts
+        self.topic_name = topic_name
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+
+        self._lock = threading.Lock()
+        self._client = None
+        self._topic = None
+        self._generation = 0  # Bumped on reconnect so consumers from an old client get dropped
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._stats = {
+            "connects": 0,
+            "reconnects": 0,
+            "consumers_created": 0,
+            "consumers_discarded": 0,
+            "borrows": 0,
+            "borrow_timeouts": 0,
+            "health_checks": 0,
+            "health_check_failures": 0
+        }
+        self._in_use = 0
+        self._healthy = False
+
+    def topic(self):
+        """The shared topic handle, connecting on first use"""
+        with self._lock:
+            if self._topic is None:
+                self._connect()
+            return self._topic
+
+    def _connect(self):
+        # Caller holds self._lock
+        self._client = KafkaClient(hosts=self.hosts)
+        self._topic = self._client.topics[self.topic_name.encode()]
+        self._stats["connects"] += 1
+        self._healthy = True
+        logger.info(f"Connected shared Kafka client to {self.hosts} (generation {self._generation})")
+
+    def reconnect(self):
+        """Drop the current client and every idle consumer, then connect again"""
+        with self._lock:
+            self._generation += 1
+            self._stats["reconnects"] += 1
+            self._client = None
+            self._topic = None
+            self._healthy = False
+            while True:
+                try:
+                    _, consumer = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                self._discard(consumer)
+            self._connect()
+
+    def _discard(self, consumer):
+        self._stats["consumers_discarded"] += 1
+        try:
+            consumer.stop()
+        except Exception as e:
+            logger.warning(f"Error stopping pooled consumer: {e}")
+
+    def _new_consumer(self):
+        topic = self.topic()
+        with self._lock:
+            generation = self._generation
+            self._stats["consumers_created"] += 1
+        consumer = topic.get_simple_consumer(
+            reset_offset_on_start=True,
+            auto_offset_reset=OffsetType.LATEST,
+            consumer_timeout_ms=1000,
+            queued_max_messages=10  # Lookups only ever want the first message after a seek
+        )
+        return generation, consumer
+
+    @contextmanager
+    def consumer(self):
+        """Borrow a lookup consumer; it is discarded instead of returned if the caller fails"""
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            with self._lock:
+                self._stats["borrow_timeouts"] += 1
+            raise PoolTimeout(f"No Kafka consumer available within {self.acquire_timeout}s")
+
+        try:
+            try:
+                generation, consumer = self._idle.get_nowait()
+            except queue.Empty:
+                generation, consumer = self._new_consumer()
+
+            with self._lock:
+                self._stats["borrows"] += 1
+                self._in_use += 1
+
+            try:
+                yield consumer
+            except Exception:
+                with self._lock:
+                    self._in_use -= 1
+                    self._discard(consumer)
+                raise
+
+            with self._lock:
+                self._in_use -= 1
+                if generation == self._generation:
+                    self._idle.put((generation, consumer))
+                else:
+                    self._discard(consumer)
+        finally:
+            self._slots.release()
+
+    def health_check(self):
+        """Refresh cluster metadata, reconnecting if the brokers can't be reached"""
+        with self._lock:
+            client = self._client
+            self._stats["health_checks"] += 1
+
+        if client is None:
+            return
+
+        try:
+            client.update_cluster()
+            with self._lock:
+                self._healthy = True
+        except Exception as e:
+            logger.error(f"Kafka health check failed, reconnecting: {e}")
+            with self._lock:
+                self._stats["health_check_failures"] += 1
+                self._healthy = False
+            try:
+                self.reconnect()
+            except Exception as e:
+                logger.error(f"Kafka reconnect failed: {e}")
+
+    def start_health_checks(self):
+        def run():
+            while True:
+                time.sleep(self.health_check_interval)
+                self.health_check()
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "healthy": self._healthy,
+                "generation": self._generation,
+                "size": self.size,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize()
+            }
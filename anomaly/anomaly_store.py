@@ -0,0 +1,86 @@
+import sqlite3
+import threading
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS anomalies (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT,
+    trace_id TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    description TEXT NOT NULL,
+    detected_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_anomalies_event_type_seq ON anomalies (event_type, seq);
+CREATE INDEX IF NOT EXISTS ix_anomalies_detected_at ON anomalies (detected_at);
+"""
+
+COLUMNS = ("id", "trace_id", "event_type", "description", "detected_at")
+
+class AnomalyStore:
+    """Append-only anomaly store backed by SQLite in WAL mode.
+
+    WAL lets the consumer thread append while request threads read, and the
+    indexes let GET /anomalies filter by event type, time range and cursor
+    without loading the whole history. Each thread gets its own connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def append(self, anomalies):
+        """Insert anomalies in one transaction"""
+        connection = self._connection()
+        with connection:
+            connection.executemany(
+                f"INSERT INTO anomalies ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})",
+                [tuple(anomaly.get(column) for column in COLUMNS) for anomaly in anomalies]
+            )
+
+    def count(self):
+        """Number of anomalies stored; rows are never deleted so the last seq is the count"""
+        row = self._connection().execute("SELECT MAX(seq) FROM anomalies").fetchone()
+        return row[0] or 0
+
+    def query(self, event_type=None, start=None, end=None, limit=100, cursor=None):
+        """Return up to limit anomalies after cursor, plus the cursor for the next page (or None)"""
+        clauses = []
+        params = []
+
+        if event_type is not None:
+            clauses.append("event_type = ?")
+            params.append(event_type)
+        if start is not None:
+            clauses.append("detected_at >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("detected_at < ?")
+            params.append(end)
+        if cursor is not None:
+            clauses.append("seq > ?")
+            params.append(cursor)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._connection().execute(
+            f"SELECT seq, {', '.join(COLUMNS)} FROM anomalies {where} ORDER BY seq LIMIT ?",
+            params + [limit + 1]  # One extra row tells us whether there is another page
+        ).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1]["seq"]
+
+        return [{column: row[column] for column in COLUMNS} for row in rows], next_cursor
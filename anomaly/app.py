@@ -1,115 +1,240 @@
 import os
-import json
 import logging
-import logging.config
 import yaml
-from datetime import datetime
+import time
+import threading
+from datetime import datetime, timezone
 from flask import Flask, request, jsonify
 from kafka import KafkaConsumer
-
-# Load logging configuration
-with open("ano_log_conf.yml", "r") as log_file:
-    log_config = yaml.safe_load(log_file)
-logging.config.dictConfig(log_config)
+from prometheus_client import Counter, Gauge, Histogram
+from anomaly_store import AnomalyStore
+from detectors import AnomalyEngine
+from metrics import init_metrics
+from event_common.log_setup import setup_logging
+from event_common.codec import decode
+
+# Load logging configuration; handlers write from a background thread
+setup_logging("ano_log_conf.yml")
 logger = logging.getLogger("anomalyLogger")
+event_logger = logging.getLogger("anomalyLogger.events")  # Sampled per-event messages
 
 # Load service configuration
 with open("anomaly_conf.yml", "r") as conf_file:
     app_config = yaml.safe_load(conf_file)
 
-# Environment variables for thresholds
-CPU_MAX = int(os.getenv("CPU_MAX", 90))
-SCORE_MAX = int(os.getenv("SCORE_MAX", 1000000))
+# Rules may name an environment variable that overrides their upper bound
+for rule in app_config["detection"]["rules"]:
+    variable = rule.pop("env", None)
+    if variable and variable in os.environ:
+        rule["max"] = float(os.environ[variable])
+    logger.info(f"{rule['event_type']} {rule['field']} bounds: min {rule.get('min')}, max {rule.get('max')}")
 
-# Log thresholds on startup
-logger.info(f"CPU_MAX threshold: {CPU_MAX}")
-logger.info(f"SCORE_MAX threshold: {SCORE_MAX}")
+engine = AnomalyEngine.from_config(app_config["detection"])
+logger.info(f"Anomaly detectors: {[(type(d).__name__, d.event_type, d.field) for d in engine.detectors]}")
 
 # Flask app setup
 app = Flask(__name__)
+init_metrics(app)
+
+# Hot-path metrics served at /metrics
+MESSAGES_CONSUMED = Counter("kafka_messages_consumed_total", "Messages read from the events topic")
+ANOMALIES_DETECTED = Counter("anomalies_detected_total", "Anomalies found", ["event_type"])
+FLUSH_LATENCY = Histogram("anomaly_flush_duration_seconds", "Time to append pending anomalies and commit offsets")
+CONSUMER_LAG = Gauge("kafka_consumer_lag", "Messages between the consumer position and the log end", ["partition"])
 
-# JSON datastore path
+# SQLite datastore, safe to append to while requests read it
 DATASTORE_PATH = app_config["datastore"]["filepath"]
+DEFAULT_PAGE_SIZE = app_config["datastore"]["default_page_size"]
+MAX_PAGE_SIZE = app_config["datastore"]["max_page_size"]
+store = AnomalyStore(DATASTORE_PATH)
 
 # Kafka configuration
 KAFKA_HOST = app_config["kafka"]["hostname"]
 KAFKA_PORT = app_config["kafka"]["port"]
 KAFKA_TOPIC = "events"
-
-# Helper function to detect anomalies
-def detect_anomalies(events):
-    anomalies = []
-    for event in events:
-        if event["event_type"] == "PlayerActivityEvent" and event["score"] > SCORE_MAX:
-            anomalies.append({
-                "id": event["id"],
-                "trace_id": event["trace_id"],
-                "event_type": event["event_type"],
-                "description": f"Score detected: {event['score']}; threshold: {SCORE_MAX}"
-            })
-            logger.debug(f"Anomaly detected: {anomalies[-1]}")
-        elif event["event_type"] == "ServerPerformanceEvent" and event["cpu_usage"] > CPU_MAX:
-            anomalies.append({
-                "id": event["id"],
-                "trace_id": event["trace_id"],
-                "event_type": event["event_type"],
-                "description": f"CPU usage detected: {event['cpu_usage']}%; threshold: {CPU_MAX}%"
-            })
-            logger.debug(f"Anomaly detected: {anomalies[-1]}")
+CONSUMER_CONFIG = app_config["consumer"]
+
+def detect_anomalies(messages):
+    """Screens a batch of Kafka messages with the configured rules and detectors"""
+    anomalies = engine.evaluate(messages)
+    for anomaly in anomalies:
+        ANOMALIES_DETECTED.labels(anomaly["event_type"]).inc()
+        event_logger.debug("Anomaly detected: %s", anomaly["description"], extra={"trace_id": anomaly["trace_id"]})
     return anomalies
 
-# PUT /update endpoint
-@app.route("/update", methods=["PUT"])
-def update_anomalies():
-    logger.debug("Accessing /update endpoint")
-    consumer = KafkaConsumer(
+# Shared between the consumer thread and PUT /update
+flush_requested = threading.Event()
+flush_done = threading.Condition()
+anomalies_count = 0
+
+def flush(consumer, pending):
+    """Persists pending anomalies, then commits offsets so nothing is skipped on restart"""
+    global anomalies_count
+
+    start = time.perf_counter()
+    if pending:
+        detected_at = datetime.utcnow().isoformat()
+        for anomaly in pending:
+            anomaly.setdefault("detected_at", detected_at)
+        store.append(pending)
+        anomalies_count = store.count()
+        logger.info(f"Appended {len(pending)} anomalies to the datastore ({anomalies_count} total)")
+        pending.clear()
+    consumer.commit()
+    FLUSH_LATENCY.observe(time.perf_counter() - start)
+
+    with flush_done:
+        flush_done.notify_all()
+
+def make_consumer():
+    """Join the consumer group; values are decoded per record so one bad message can be skipped"""
+    return KafkaConsumer(
         KAFKA_TOPIC,
         bootstrap_servers=f"{KAFKA_HOST}:{KAFKA_PORT}",
-        auto_offset_reset="earliest",
-        enable_auto_commit=True,
-        value_deserializer=lambda x: json.loads(x.decode("utf-8"))
+        group_id=CONSUMER_CONFIG["group_id"],
+        auto_offset_reset="earliest",  # Only used the first time, afterwards the committed offset wins
+        enable_auto_commit=False
     )
 
-    events = [message.value for message in consumer]
-    logger.info(f"Retrieved {len(events)} events from Kafka")
+def decode_records(records):
+    """Decoded messages of a poll, logging and dropping any that cannot be decoded"""
+    batch = []
+    for messages in records.values():
+        for message in messages:
+            try:
+                batch.append(decode(message.value))
+            except ValueError as e:
+                logger.error(f"Skipping undecodable message at partition {message.partition} "
+                             f"offset {message.offset}: {e}")
+    return batch
+
+def consume_events():
+    """Evaluates polled batches of events, rejoining the group whenever the consumer fails"""
+    global anomalies_count
+
+    anomalies_count = store.count()
+
+    while True:
+        try:
+            consumer = make_consumer()
+        except Exception as e:
+            logger.error(f"Anomaly consumer could not join group {CONSUMER_CONFIG['group_id']}, "
+                         f"retrying in {CONSUMER_CONFIG['retry_interval']}s: {e}")
+            time.sleep(CONSUMER_CONFIG["retry_interval"])
+            continue
+
+        logger.info(f"Anomaly consumer started in group {CONSUMER_CONFIG['group_id']}")
+
+        try:
+            consume_loop(consumer)
+        except Exception as e:
+            logger.error(f"Anomaly consumer failed, rejoining in {CONSUMER_CONFIG['retry_interval']}s: {e}")
+            try:
+                consumer.close(autocommit=False)
+            except Exception:
+                pass
+            time.sleep(CONSUMER_CONFIG["retry_interval"])
+
+def consume_loop(consumer):
+    # Anomalies not yet flushed are dropped on failure; their offsets weren't committed, so they are re-read
+    pending = []
+    last_flush = time.monotonic()
+
+    while True:
+        records = consumer.poll(timeout_ms=1000, max_records=CONSUMER_CONFIG["max_poll_records"])
+        batch = decode_records(records)
+        MESSAGES_CONSUMED.inc(sum(len(messages) for messages in records.values()))
+        if batch:
+            pending.extend(detect_anomalies(batch))
+
+        # Highwater marks arrive with each fetch, so lag costs no extra broker round-trip
+        for partition in consumer.assignment():
+            highwater = consumer.highwater(partition)
+            if highwater is not None:
+                CONSUMER_LAG.labels(str(partition.partition)).set(highwater - consumer.position(partition))
+
+        if flush_requested.is_set() or time.monotonic() - last_flush >= CONSUMER_CONFIG["flush_interval"]:
+            flush_requested.clear()
+            flush(consumer, pending)
+            last_flush = time.monotonic()
+
+def setup_consumer_thread():
+    consumer_thread = threading.Thread(target=consume_events)
+    consumer_thread.daemon = True
+    consumer_thread.start()
+
+# PUT /update endpoint
+@app.route("/update", methods=["PUT"])
+def update_anomalies():
+    logger.debug("Accessing /update endpoint")
 
-    anomalies = detect_anomalies(events)
+    # Ask the streaming consumer to flush now rather than rescanning the topic
+    with flush_done:
+        flush_requested.set()
+        flushed = flush_done.wait(timeout=CONSUMER_CONFIG["flush_timeout"])
 
-    # Write anomalies to JSON datastore
-    with open(DATASTORE_PATH, "w") as f:
-        json.dump(anomalies, f, indent=4)
+    if not flushed:
+        logger.warning("Anomaly consumer did not flush in time, returning the last known count")
 
-    logger.info(f"Anomaly detection completed. {len(anomalies)} anomalies detected.")
-    return jsonify({"anomalies_count": len(anomalies)}), 201
+    logger.info(f"Anomaly datastore flushed. {anomalies_count} anomalies detected.")
+    return jsonify({"anomalies_count": anomalies_count}), 201
 
 # GET /anomalies endpoint
 @app.route("/anomalies", methods=["GET"])
+def as_utc(moment):
+    """Naive UTC datetime, the form detected_at is stored in, so bounds with an offset compare correctly"""
+    if moment.tzinfo is not None:
+        return moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+def int_arg(name, default=None):
+    """Integer query parameter; raises ValueError rather than falling back to the default when malformed"""
+    value = request.args.get(name, None)
+    return default if value is None else int(value)
+
 def get_anomalies():
     logger.debug("Accessing /anomalies endpoint")
     event_type = request.args.get("event_type", None)
+    start_timestamp = request.args.get("start_timestamp", None)
+    end_timestamp = request.args.get("end_timestamp", None)
+
+    try:
+        limit = int_arg("limit", DEFAULT_PAGE_SIZE)
+        cursor = int_arg("cursor")
+    except ValueError as e:
+        logger.error(f"Invalid limit or cursor: {e}")
+        return jsonify({"message": "Limit and cursor must be integers."}), 400
+
+    if event_type and event_type not in ["PlayerActivityEvent", "ServerPerformanceEvent"]:
+        logger.error(f"Invalid event type: {event_type}")
+        return jsonify({"message": "Invalid event type. Must be PlayerActivityEvent or ServerPerformanceEvent."}), 400
 
-    if not os.path.exists(DATASTORE_PATH):
-        logger.error("Anomalies datastore not found.")
-        return jsonify({"message": "Anomalies datastore not found"}), 404
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        logger.error(f"Invalid limit: {limit}")
+        return jsonify({"message": f"Limit must be between 1 and {MAX_PAGE_SIZE}."}), 400
 
-    with open(DATASTORE_PATH, "r") as f:
-        anomalies = json.load(f)
+    try:
+        start = as_utc(datetime.fromisoformat(start_timestamp)).isoformat() if start_timestamp else None
+        end = as_utc(datetime.fromisoformat(end_timestamp)).isoformat() if end_timestamp else None
+    except ValueError as e:
+        logger.error(f"Invalid timestamp: {e}")
+        return jsonify({"message": "Timestamps must be ISO 8601."}), 400
 
-    if event_type:
-        if event_type not in ["PlayerActivityEvent", "ServerPerformanceEvent"]:
-            logger.error(f"Invalid event type: {event_type}")
-            return jsonify({"message": "Invalid event type. Must be PlayerActivityEvent or ServerPerformanceEvent."}), 400
-        anomalies = [a for a in anomalies if a["event_type"] == event_type]
+    anomalies, next_cursor = store.query(event_type or None, start, end, limit, cursor)
 
     if not anomalies:
-        logger.info("No anomalies found for the given event type.")
+        logger.info("No anomalies found for the given filters.")
         return "", 204
 
     logger.debug(f"Returning {len(anomalies)} anomalies.")
-    return jsonify(anomalies), 200
+    response = jsonify(anomalies)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    return response, 200
 
 # Run the app
 if __name__ == "__main__":
     logger.info("Starting Anomaly Detection Service on port 8200")
+    setup_consumer_thread()
     app.run(port=8200, host="0.0.0.0")
 
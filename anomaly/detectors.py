@@ -0,0 +1,303 @@
+from collections import OrderedDict
+import numpy as np
+
+
+# Kafka message types and the event type names anomalies are reported under
+EVENT_TYPES = {"player_event": "PlayerActivityEvent", "server_event": "ServerPerformanceEvent"}
+
+def group_ranks(rows):
+    """Position of each element among the elements with the same row, in arrival order, and that group's size"""
+    order = np.argsort(rows, kind="stable")
+    sorted_rows = rows[order]
+    starts = np.flatnonzero(np.r_[True, sorted_rows[1:] != sorted_rows[:-1]])
+    sizes = np.diff(np.r_[starts, len(rows)])
+    group = np.repeat(np.arange(len(starts)), sizes)
+
+    rank = np.empty(len(rows), dtype=np.intp)
+    size = np.empty(len(rows), dtype=np.intp)
+    rank[order] = np.arange(len(rows)) - starts[group]
+    size[order] = sizes[group]
+    return rank, size
+
+class KeySlots:
+    """Maps keys to rows of fixed-size state arrays, recycling the least recently seen key's row when full"""
+
+    def __init__(self, size):
+        self.size = size
+        self._slots = OrderedDict()
+
+    def assign(self, keys):
+        """Return each key's row (-1 if the batch has more distinct keys than rows) and the rows just recycled"""
+        unique, inverse = np.unique(keys, return_inverse=True)
+        rows = np.full(len(unique), -1, dtype=np.intp)
+        fresh = []
+
+        for i, key in enumerate(unique[:self.size]):
+            row = self._slots.pop(key, None)
+            if row is None:
+                if len(self._slots) < self.size:
+                    row = len(self._slots)  # Rows are handed out in order until all are taken
+                else:
+                    _, row = self._slots.popitem(last=False)
+                fresh.append(row)
+            self._slots[key] = row  # Most recently seen keys sit at the end
+            rows[i] = row
+
+        return rows[inverse.reshape(-1)], np.array(fresh, dtype=np.intp)
+
+class Detector:
+    """Flags values more than `threshold` standard deviations from a per-key baseline.
+
+    A batch is judged against the baseline as it stood before the batch, then
+    folded into it, so every step is a handful of array operations however
+    many events the batch holds. Keys stay silent until `warmup` values have
+    been seen, and at most `max_keys` keys keep state.
+    """
+
+    def __init__(self, event_type, field, threshold=4.0, warmup=30, min_std=0.0, key="server_id", max_keys=10000):
+        self.event_type = event_type
+        self.field = field
+        self.threshold = threshold
+        self.warmup = warmup
+        self.min_std = min_std
+        self.key = key
+        self.slots = KeySlots(max_keys)
+        self.count = np.zeros(max_keys, dtype=np.int64)
+
+    def evaluate(self, keys, values):
+        """Return the flagged mask, the baseline mean and the z-score of each value"""
+        rows, fresh = self.slots.assign(keys)
+        self.reset(fresh)
+
+        tracked = (rows >= 0) & ~np.isnan(values)
+        rows, values = rows[tracked], values[tracked]
+        mean = np.full(len(tracked), np.nan)
+        z = np.zeros(len(tracked))
+        if not len(rows):
+            return np.zeros(len(tracked), dtype=bool), mean, z
+
+        mean[tracked], std = self.baseline(rows)
+        std = np.maximum(std, self.min_std)
+        deviation = np.abs(values - mean[tracked])
+        z[tracked] = np.divide(deviation, std, out=np.where(deviation > 0, np.inf, 0.0), where=std > 0)
+
+        flagged = np.zeros(len(tracked), dtype=bool)
+        flagged[tracked] = self.count[rows] >= self.warmup
+        flagged &= z > self.threshold
+
+        rank, size = group_ranks(rows)
+        self.update(rows, values, rank, size)
+        first = rank == 0
+        self.count[rows[first]] += size[first]
+        return flagged, mean, z
+
+    def reset(self, rows):
+        self.count[rows] = 0
+
+    def baseline(self, rows):
+        raise NotImplementedError
+
+    def update(self, rows, values, rank, size):
+        raise NotImplementedError
+
+class EWMADetector(Detector):
+    """Exponentially weighted mean and variance, `alpha` being the weight of the newest value.
+
+    Tracks the weighted first and second moments, which fold in a whole batch
+    per key in closed form: a key that receives m values decays by
+    (1 - alpha)^m and the j-th value adds alpha * (1 - alpha)^(m - 1 - j).
+    """
+
+    def __init__(self, event_type, field, alpha=0.05, **options):
+        super().__init__(event_type, field, **options)
+        self.alpha = alpha
+        max_keys = self.slots.size
+        self.moment1 = np.zeros(max_keys)
+        self.moment2 = np.zeros(max_keys)
+        self.weight = np.zeros(max_keys)  # Total weight so far, corrects the bias of starting from zero
+
+    def reset(self, rows):
+        super().reset(rows)
+        self.moment1[rows] = 0
+        self.moment2[rows] = 0
+        self.weight[rows] = 0
+
+    def baseline(self, rows):
+        weight = self.weight[rows]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.moment1[rows] / weight
+            variance = self.moment2[rows] / weight - mean ** 2
+        return mean, np.sqrt(np.maximum(np.nan_to_num(variance), 0))
+
+    def update(self, rows, values, rank, size):
+        keep = 1 - self.alpha
+        first = rank == 0
+        decay = keep ** size[first]
+        touched = rows[first]
+        self.moment1[touched] *= decay
+        self.moment2[touched] *= decay
+        self.weight[touched] = self.weight[touched] * decay + (1 - decay)
+
+        weights = self.alpha * keep ** (size - 1 - rank)
+        np.add.at(self.moment1, rows, weights * values)
+        np.add.at(self.moment2, rows, weights * values ** 2)
+
+class RollingZScoreDetector(Detector):
+    """Mean and standard deviation of the last `window` values of each key, kept in a ring per key"""
+
+    def __init__(self, event_type, field, window=100, **options):
+        super().__init__(event_type, field, **options)
+        self.window = window
+        self.values = np.full((self.slots.size, window), np.nan)
+        self.cursor = np.zeros(self.slots.size, dtype=np.intp)
+
+    def reset(self, rows):
+        super().reset(rows)
+        self.values[rows] = np.nan
+        self.cursor[rows] = 0
+
+    def baseline(self, rows):
+        unique, inverse = np.unique(rows, return_inverse=True)
+        recent = self.values[unique]
+        filled = (~np.isnan(recent)).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.nansum(recent, axis=1) / filled
+            std = np.sqrt(np.nansum((recent - mean[:, None]) ** 2, axis=1) / filled)
+        return mean[inverse], std[inverse]
+
+    def update(self, rows, values, rank, size):
+        # Only the last `window` values of each key survive the batch
+        skipped = np.maximum(size - self.window, 0)
+        kept = rank >= skipped
+        rows, offsets = rows[kept], (rank - skipped)[kept]
+        self.values[rows, (self.cursor[rows] + offsets) % self.window] = values[kept]
+
+        first = rank[kept] == skipped[kept]
+        touched = rows[first]
+        self.cursor[touched] = (self.cursor[touched] + np.minimum(size[kept][first], self.window)) % self.window
+
+DETECTORS = {"ewma": EWMADetector, "zscore": RollingZScoreDetector}
+
+def make_detector(method, event_type, field, **options):
+    """Build the detector named in the configuration"""
+    if method not in DETECTORS:
+        raise ValueError(f"Unknown anomaly detector {method}")
+    return DETECTORS[method](event_type, field, **options)
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def float_column(values):
+    """Values as floats, NaN for anything missing or non-numeric, so one bad payload can't fail the batch"""
+    try:
+        return np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        return np.array([to_float(value) for value in values])
+
+class ThresholdRule:
+    """Absolute bounds on a field, with per-server overrides of either bound"""
+
+    def __init__(self, event_type, field, min=None, max=None, servers=None):
+        self.event_type = event_type
+        self.field = field
+        self.min = min
+        self.max = max
+        self.servers = servers or {}
+
+    def limits(self, server_ids):
+        """Lower and upper bound for each event, NaN where there is none"""
+        lower = np.full(len(server_ids), np.nan if self.min is None else self.min, dtype=float)
+        upper = np.full(len(server_ids), np.nan if self.max is None else self.max, dtype=float)
+        for server_id, bounds in self.servers.items():
+            matches = server_ids == server_id
+            if "min" in bounds:
+                lower[matches] = np.nan if bounds["min"] is None else bounds["min"]
+            if "max" in bounds:
+                upper[matches] = np.nan if bounds["max"] is None else bounds["max"]
+        return lower, upper
+
+    def evaluate(self, server_ids, values):
+        """Return the masks of values below and above their bounds, and the bounds"""
+        lower, upper = self.limits(server_ids)
+        with np.errstate(invalid="ignore"):
+            return values < lower, values > upper, lower, upper
+
+class AnomalyEngine:
+    """Screens batches of decoded Kafka messages against the configured rules and detectors.
+
+    Each message type's payloads become NumPy columns once per batch; every
+    rule and detector then runs over the whole column.
+    """
+
+    def __init__(self, rules, detectors):
+        self.rules = rules
+        self.detectors = detectors
+        self.fields = {}
+        for check in rules + detectors:
+            self.fields.setdefault(check.event_type, set()).add(check.field)
+
+    @classmethod
+    def from_config(cls, config):
+        rules = [ThresholdRule(**rule) for rule in config.get("rules", [])]
+        detectors = [make_detector(**{"max_keys": config.get("max_keys", 10000), **detector})
+                     for detector in config.get("detectors", [])]
+        return cls(rules, detectors)
+
+    def columns(self, payloads, event_type):
+        """Identifiers as object arrays and the checked fields as floats, NaN where missing"""
+        columns = {
+            "trace_id": np.array([payload.get("trace_id") for payload in payloads], dtype=object),
+            "server_id": np.array([payload.get("server_id") for payload in payloads], dtype=object)
+        }
+        for detector in self.detectors:
+            if detector.event_type == event_type and detector.key not in columns:
+                columns[detector.key] = np.array([payload.get(detector.key) for payload in payloads], dtype=object)
+        for field in self.fields.get(event_type, ()):
+            columns[field] = float_column([payload.get(field) for payload in payloads])
+        return columns
+
+    def evaluate(self, messages):
+        """Return the anomalies found in a batch of messages, in the order the checks are configured"""
+        payloads = {event_type: [] for event_type in self.fields}
+        for message in messages:
+            if isinstance(message, dict) and message.get("type") in payloads and isinstance(message.get("payload"), dict):
+                payloads[message["type"]].append(message["payload"])
+
+        anomalies = []
+        for event_type, batch in payloads.items():
+            if not batch:
+                continue
+            columns = self.columns(batch, event_type)
+
+            def report(index, description):
+                anomalies.append({
+                    "id": columns["trace_id"][index],  # Events carry no other identifier
+                    "trace_id": columns["trace_id"][index],
+                    "event_type": EVENT_TYPES[event_type],
+                    "description": description
+                })
+
+            for rule in self.rules:
+                if rule.event_type != event_type:
+                    continue
+                values = columns[rule.field]
+                below, above, lower, upper = rule.evaluate(columns["server_id"], values)
+                for i in np.flatnonzero(below):
+                    report(i, f"{rule.field} {values[i]:g} below {lower[i]:g} on server {columns['server_id'][i]}")
+                for i in np.flatnonzero(above):
+                    report(i, f"{rule.field} {values[i]:g} above {upper[i]:g} on server {columns['server_id'][i]}")
+
+            for detector in self.detectors:
+                if detector.event_type != event_type:
+                    continue
+                keys = columns[detector.key].astype(str)
+                values = columns[detector.field]
+                flagged, mean, z = detector.evaluate(keys, values)
+                for i in np.flatnonzero(flagged):
+                    report(i, f"{detector.field} {values[i]:g} is {z[i]:.1f} standard deviations from "
+                              f"the rolling mean {mean[i]:.4g} for {detector.key} {keys[i]}")
+
+        return anomalies
@@ -0,0 +1,30 @@
+import time
+from flask import Response, g, request
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling HTTP requests",
+    ["operation", "method", "status"]
+)
+
+def init_metrics(app, path="/metrics"):
+    """Times every request by Flask endpoint and serves the Prometheus registry at `path`"""
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_latency(response):
+        start = g.pop("request_start", None)
+        if start is not None:
+            operation = request.endpoint or "unmatched"
+            REQUEST_LATENCY.labels(operation, request.method, str(response.status_code)).observe(
+                time.perf_counter() - start)
+        return response
+
+    @app.route(path, methods=["GET"])
+    def metrics():
+        return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
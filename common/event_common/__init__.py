@@ -0,0 +1 @@
+"""Code shared by every service: the Kafka event codec, the logging setup, the metrics middleware and the dashboard event stream"""
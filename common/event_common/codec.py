@@ -0,0 +1,78 @@
+import json
+import struct
+import msgpack
+
+
+# Binary messages start with MAGIC, the layout version and the event type code
+MAGIC = b"EV"
+VERSION = 1
+HEADER = struct.Struct(">2sBB")
+
+TYPE_CODES = {"player_event": 1, "server_event": 2}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+
+# Field order of each event type's payload, by layout version. A new version
+# gets its own entry so messages already on the topic stay decodable.
+LAYOUTS = {
+    1: {
+        "player_event": ("trace_id", "player_id", "server_id", "action", "score", "timestamp"),
+        "server_event": ("trace_id", "server_id", "uptime", "cpu_usage", "memory_usage", "timestamp")
+    }
+}
+
+def encode(message, wire_format="msgpack"):
+    """Serialise a {type, datetime, payload} message as versioned msgpack, or as the legacy JSON envelope"""
+    if wire_format == "json":
+        return json.dumps(message).encode("utf-8")
+
+    event_type = message["type"]
+    payload = message["payload"]
+    fields = LAYOUTS[VERSION][event_type]
+    # The envelope's keys are implied by the layout, so only the values go on the wire
+    values = [message["datetime"]] + [payload.get(field) for field in fields]
+    return HEADER.pack(MAGIC, VERSION, TYPE_CODES[event_type]) + msgpack.packb(values)
+
+def is_binary(value):
+    return value[:len(MAGIC)] == MAGIC
+
+def decode_json(value):
+    """The legacy JSON envelope, which has to be an object"""
+    message = json.loads(value.decode("utf-8"))
+    if not isinstance(message, dict):
+        raise ValueError(f"Expected a JSON object, got {type(message).__name__}")
+    return message
+
+def message_type(value):
+    """Event type of an encoded message; binary messages are routed from the header alone"""
+    if is_binary(value):
+        if len(value) < HEADER.size:
+            raise ValueError("Truncated message header")
+        _, _, code = HEADER.unpack_from(value)
+        if code not in TYPE_NAMES:
+            raise ValueError(f"Unknown event type code {code}")
+        return TYPE_NAMES[code]
+    return decode_json(value).get("type")
+
+def decode(value):
+    """Rebuild the {type, datetime, payload} message from either wire format"""
+    if not is_binary(value):
+        return decode_json(value)
+
+    if len(value) < HEADER.size:
+        raise ValueError("Truncated message header")
+    _, version, code = HEADER.unpack_from(value)
+    if version not in LAYOUTS:
+        raise ValueError(f"Unsupported message version {version}")
+    if code not in TYPE_NAMES:
+        raise ValueError(f"Unknown event type code {code}")
+
+    event_type = TYPE_NAMES[code]
+    try:
+        values = msgpack.unpackb(value[HEADER.size:])
+    except msgpack.UnpackException as e:
+        raise ValueError(f"Malformed message body: {e}") from e
+
+    fields = LAYOUTS[version][event_type]
+    if not isinstance(values, list) or len(values) != len(fields) + 1:
+        raise ValueError(f"Expected {len(fields) + 1} values for a version {version} {event_type}")
+    return {"type": event_type, "datetime": values[0], "payload": dict(zip(fields, values[1:]))}
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import logging
+import time
+
+
+logger = logging.getLogger("basicLogger")
+
+class _Client:
+    def __init__(self, queue_size):
+        self.queue = asyncio.Queue(queue_size)
+        self.lagging = False
+
+class EventStream:
+    """Pushes one server-side computed document to every connected Server-Sent Events client.
+
+    A single pump task calls source() every `interval` seconds. If the
+    document changed it encodes the changed top-level keys once as a "delta"
+    event and queues the same bytes for every client, so the cost per update
+    doesn't grow with the number of dashboards. New clients start with a full
+    "snapshot" event. A client that falls queue_size updates behind is
+    disconnected; EventSource reconnects and resyncs from a fresh snapshot.
+    """
+
+    def __init__(self, source, interval=1.0, keepalive=15.0, max_clients=500, queue_size=16):
+        self.source = source
+        self.interval = interval
+        self.keepalive = keepalive
+        self.max_clients = max_clients
+        self.queue_size = queue_size
+        self._clients = set()
+        self._state = None
+        self._version = 0
+        self._snapshot = None  # Encoded snapshot event for self._version
+        self._pump_task = None
+        self._stats = {"connects": 0, "disconnects": 0, "rejected": 0, "dropped_slow": 0, "updates": 0}
+
+    @staticmethod
+    def _encode(event, version, data):
+        return f"event: {event}\nid: {version}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+    def _refresh(self):
+        """Read the source and fan out a delta if anything changed"""
+        state = self.source()
+        if state is None or state == self._state:
+            return
+
+        previous = self._state or {}
+        delta = {key: value for key, value in state.items() if previous.get(key) != value}
+        self._state = state
+        self._version += 1
+        self._snapshot = None
+        self._stats["updates"] += 1
+
+        message = self._encode("delta", self._version, delta)
+        for client in list(self._clients):
+            try:
+                client.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._stats["dropped_slow"] += 1
+                client.lagging = True  # Its loop hangs up so the browser reconnects for a snapshot
+
+    def _snapshot_message(self):
+        if self._snapshot is None:
+            self._snapshot = self._encode("snapshot", self._version, self._state)
+        return self._snapshot
+
+    async def _pump(self):
+        while self._clients:
+            try:
+                self._refresh()
+            except Exception as e:
+                logger.error(f"Event stream source failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def _ensure_pump(self):
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.get_running_loop().create_task(self._pump())
+
+    async def serve(self, scope, receive, send):
+        """ASGI handler for one text/event-stream connection"""
+        if len(self._clients) >= self.max_clients:
+            self._stats["rejected"] += 1
+            await send({"type": "http.response.start", "status": 503,
+                        "headers": [(b"content-type", b"text/plain"), (b"retry-after", b"5")]})
+            await send({"type": "http.response.body", "body": b"Too many stream clients"})
+            return
+
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/event-stream"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no")  # Stop reverse proxies from buffering the stream
+        ]})
+
+        if self._state is None:
+            self._refresh()
+        client = _Client(self.queue_size)
+        if self._state is not None:
+            client.queue.put_nowait(self._snapshot_message())
+        self._clients.add(client)
+        self._stats["connects"] += 1
+        self._ensure_pump()
+
+        disconnected = asyncio.ensure_future(self._wait_for_disconnect(receive))
+        try:
+            last_sent = time.monotonic()
+            while not disconnected.done() and not client.lagging:
+                try:
+                    message = await asyncio.wait_for(client.queue.get(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    if time.monotonic() - last_sent < self.keepalive:
+                        continue
+                    message = b": keepalive\n\n"  # Comment line keeps idle proxies from closing the stream
+                await send({"type": "http.response.body", "body": message, "more_body": True})
+                last_sent = time.monotonic()
+        except OSError:
+            pass  # Client went away mid-write
+        finally:
+            disconnected.cancel()
+            self._clients.discard(client)
+            self._stats["disconnects"] += 1
+
+    @staticmethod
+    async def _wait_for_disconnect(receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    def metrics(self):
+        return {**self._stats, "clients": len(self._clients), "version": self._version}
+
+class EventStreamMiddleware:
+    """Serves an EventStream at `path` directly on the ASGI loop, ahead of the Flask app.
+
+    Streaming through Flask would tie up a WSGI worker thread per open
+    dashboard; here each client is just a queue and a coroutine.
+    """
+
+    def __init__(self, app, path, stream):
+        self.app = app
+        self.path = path
+        self.stream = stream
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == self.path and scope["method"] == "GET":
+            await self.stream.serve(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
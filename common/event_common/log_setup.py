@@ -0,0 +1,77 @@
+import atexit
+import itertools
+import json
+import logging
+import logging.config
+import queue
+from logging.handlers import QueueHandler, QueueListener
+import yaml
+
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, with trace_id and any other `extra` fields as top-level keys"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Passes one record in every `every`, for per-event messages that would flood the log at full rate"""
+
+    def __init__(self, every=100):
+        super().__init__()
+        self.every = every
+        self._counter = itertools.count()
+
+    def filter(self, record):
+        return next(self._counter) % self.every == 0
+
+class DeferredQueueHandler(QueueHandler):
+    """Queues the record untouched so message formatting happens on the listener thread.
+
+    The stock QueueHandler formats in the caller to make records safe to
+    pickle; these records never leave the process, so that work is skipped.
+    """
+
+    def prepare(self, record):
+        return record
+
+def setup_logging(config_path, log_filename=None):
+    """Apply a dictConfig file, then move every handler behind a queue drained by a background thread.
+
+    Loggers keep their own handler sets: each distinct set gets its own queue
+    and QueueListener, so the calling thread only ever does a queue put.
+    """
+    with open(config_path, "r") as f:
+        config = yaml.safe_load(f)
+    if log_filename:
+        config['handlers']['file']['filename'] = log_filename
+    logging.config.dictConfig(config)
+
+    loggers = [logging.getLogger()] + [logging.getLogger(name) for name in config.get('loggers', {})]
+    queue_handlers = {}
+
+    for logger in loggers:
+        handlers = tuple(logger.handlers)
+        if not handlers:
+            continue
+        if handlers not in queue_handlers:
+            log_queue = queue.SimpleQueue()
+            listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+            listener.start()
+            atexit.register(listener.stop)  # Drain what is still queued on shutdown
+            queue_handlers[handlers] = DeferredQueueHandler(log_queue)
+        logger.handlers = [queue_handlers[handlers]]
@@ -0,0 +1,49 @@
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling HTTP requests",
+    ["operation", "method", "status"]
+)
+
+class MetricsMiddleware:
+    """Times every request by operationId and serves the Prometheus registry at `path`.
+
+    Sits outside connexion's routing, so the operationId is read back from the
+    routing extension once the request completes; requests that match no
+    operation are recorded as "unmatched".
+    """
+
+    def __init__(self, app, path="/metrics"):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if scope["path"] == self.path:
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", CONTENT_TYPE_LATEST.encode("latin-1"))]})
+            await send({"type": "http.response.body", "body": generate_latest()})
+            return
+
+        status = 500  # Reported if the app fails before starting a response
+
+        async def timed_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        # Routing copies the scope shallowly, so an extensions dict created here is shared with it
+        extensions = scope.setdefault("extensions", {})
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            operation = extensions.get("connexion_routing", {}).get("operation_id") or "unmatched"
+            REQUEST_LATENCY.labels(operation, scope["method"], str(status)).observe(time.perf_counter() - start)
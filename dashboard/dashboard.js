@@ -4,20 +4,28 @@ const statsUrl = `http://${host}:8110/stats`;
 const analyzerUrl = `http://${host}:8100/analyzer`;
 const randomEventUrl = `http://${host}:8100/random-event`;
 
+// Push channels; the backend sends a full snapshot on connect, then only the fields that changed
+const statsStreamUrl = `http://${host}:8110/statistics/stream`;
+const analyzerStreamUrl = `http://${host}:8100/stats/stream`;
+
+
+function render(elementId, data) {
+    document.getElementById(elementId).textContent = JSON.stringify(data, null, 2);
+    document.getElementById('last-updated').textContent = new Date().toLocaleTimeString();
+}
 
 // Function to fetch and update statistics
 async function fetchStats() {
     const response = await fetch(statsUrl);
     const data = await response.json();
-    document.getElementById('stats').textContent = JSON.stringify(data, null, 2);
-    document.getElementById('last-updated').textContent = new Date().toLocaleTimeString();
+    render('stats', data);
 }
 
 // Function to fetch and update analyzer data
 async function fetchAnalyzerData() {
     const response = await fetch(analyzerUrl);
     const data = await response.json();
-    document.getElementById('analyzer').textContent = JSON.stringify(data, null, 2);
+    render('analyzer', data);
 }
 
 // Function to fetch and display a random event
@@ -27,9 +35,40 @@ async function fetchRandomEvent() {
     document.getElementById('random-event').textContent = JSON.stringify(data, null, 2);
 }
 
-// Update the data every 2–4 seconds
-setInterval(() => {
-    fetchStats();
-    fetchAnalyzerData();
-    fetchRandomEvent();
-}, Math.random() * 2000 + 2000);  // Random interval between 2 and 4 seconds
+// Poll every 2–4 seconds; used when a stream can't be opened
+function startPolling(fetchData) {
+    fetchData();
+    setInterval(fetchData, Math.random() * 2000 + 2000);  // Random interval between 2 and 4 seconds
+}
+
+// Subscribe to a push stream, falling back to polling if the browser or server doesn't support it
+function subscribe(streamUrl, elementId, fetchData) {
+    if (!window.EventSource) {
+        startPolling(fetchData);
+        return;
+    }
+
+    let state = {};
+    const source = new EventSource(streamUrl);
+
+    source.addEventListener('snapshot', (event) => {
+        state = JSON.parse(event.data);
+        render(elementId, state);
+    });
+
+    source.addEventListener('delta', (event) => {
+        state = Object.assign({}, state, JSON.parse(event.data));
+        render(elementId, state);
+    });
+
+    // EventSource retries dropped connections itself; CLOSED means the server refused the stream
+    source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+            startPolling(fetchData);
+        }
+    };
+}
+
+subscribe(statsStreamUrl, 'stats', fetchStats);
+subscribe(analyzerStreamUrl, 'analyzer', fetchAnalyzerData);
+startPolling(fetchRandomEvent);
@@ -0,0 +1,323 @@
+import math
+import numpy as np
+
+
+OTHER_GROUP = "__other__"
+
+class RunningStat:
+    """Count, sum, min and max of a value; merging two is exact, so means stay true across batches"""
+
+    def __init__(self, count=0, total=0.0, minimum=None, maximum=None):
+        self.count = count
+        self.total = total
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def update(self, values):
+        if values.size == 0:
+            return
+        self.update_from(int(values.size), float(values.sum()), float(values.min()), float(values.max()))
+
+    def merge(self, other):
+        self.update_from(other.count, other.total, other.minimum, other.maximum)
+
+    def update_from(self, count, total, minimum, maximum):
+        if not count:
+            return
+        self.count += count
+        self.total += total
+        if minimum is not None:
+            self.minimum = minimum if self.minimum is None else min(self.minimum, minimum)
+        if maximum is not None:
+            self.maximum = maximum if self.maximum is None else max(self.maximum, maximum)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self):
+        return {"count": self.count, "mean": self.mean, "min": self.minimum, "max": self.maximum}
+
+    def to_dict(self):
+        return {"count": self.count, "total": self.total, "min": self.minimum, "max": self.maximum}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(state["count"], state["total"], state["min"], state["max"])
+
+class DDSketch:
+    """Quantile sketch with bounded relative error (DDSketch, Masson et al., VLDB 2019).
+
+    Values fall into logarithmically sized buckets, so any quantile is
+    estimated within `relative_accuracy` of the true value. Sketches with the
+    same accuracy merge by adding bucket counts. When more than `max_buckets`
+    are in use the lowest ones are collapsed, keeping memory bounded at the
+    cost of accuracy for the smallest values only.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+
+    @property
+    def count(self):
+        return self.zero_count + sum(self.positive.values()) + sum(self.negative.values())
+
+    def _add_to(self, store, magnitudes):
+        keys = np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64)
+        unique_keys, counts = np.unique(keys, return_counts=True)
+        for key, count in zip(unique_keys.tolist(), counts.tolist()):
+            store[key] = store.get(key, 0) + count
+        self._collapse(store)
+
+    def _collapse(self, store):
+        if len(store) <= self.max_buckets:
+            return
+        keys = sorted(store)
+        overflow = keys[:len(keys) - self.max_buckets + 1]
+        target = keys[len(overflow)]
+        store[target] += sum(store.pop(key) for key in overflow)
+
+    def update(self, values):
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return
+        self.zero_count += int(np.count_nonzero(values == 0))
+        positives = values[values > 0]
+        negatives = values[values < 0]
+        if positives.size:
+            self._add_to(self.positive, positives)
+        if negatives.size:
+            self._add_to(self.negative, -negatives)
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+            self._collapse(store)
+        self.zero_count += other.zero_count
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        total = self.count
+        if total == 0:
+            return None
+
+        rank = q * (total - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive))
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "zero_count": self.zero_count,
+            "positive": {str(k): v for k, v in self.positive.items()},
+            "negative": {str(k): v for k, v in self.negative.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, state, max_buckets=2048):
+        sketch = cls(state["relative_accuracy"], max_buckets)
+        sketch.zero_count = state["zero_count"]
+        sketch.positive = {int(k): v for k, v in state["positive"].items()}
+        sketch.negative = {int(k): v for k, v in state["negative"].items()}
+        return sketch
+
+class Metric:
+    """A RunningStat and a DDSketch over the same value"""
+
+    def __init__(self, relative_accuracy, stat=None, sketch=None):
+        self.stat = stat or RunningStat()
+        self.sketch = sketch or DDSketch(relative_accuracy)
+
+    def update(self, values):
+        self.stat.update(values)
+        self.sketch.update(values)
+
+    def merge(self, other):
+        self.stat.merge(other.stat)
+        self.sketch.merge(other.sketch)
+
+    def summary(self):
+        return {
+            **self.stat.summary(),
+            "p50": self.sketch.quantile(0.50),
+            "p95": self.sketch.quantile(0.95),
+            "p99": self.sketch.quantile(0.99)
+        }
+
+    def to_dict(self):
+        return {"stat": self.stat.to_dict(), "sketch": self.sketch.to_dict()}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(state["sketch"]["relative_accuracy"],
+                   RunningStat.from_dict(state["stat"]), DDSketch.from_dict(state["sketch"]))
+
+class GroupedStats:
+    """Per-key RunningStats for several fields, capped at max_groups keys.
+
+    Keys beyond the cap are folded into a single "__other__" group so a flood
+    of distinct server ids or actions can't grow memory without bound.
+    """
+
+    def __init__(self, fields, max_groups):
+        self.fields = fields
+        self.max_groups = max_groups
+        self.groups = {}
+
+    def _group(self, key):
+        if key not in self.groups:
+            if len(self.groups) >= self.max_groups:
+                key = OTHER_GROUP
+            self.groups.setdefault(key, {field: RunningStat() for field in self.fields})
+        return self.groups[key]
+
+    def update(self, keys, columns):
+        """Vectorized update: keys is a sequence of group keys, columns maps field -> float array"""
+        if len(keys) == 0:
+            return
+        unique_keys, inverse = np.unique(np.asarray(keys, dtype=object).astype(str), return_inverse=True)
+        counts = np.bincount(inverse)
+
+        for field, values in columns.items():
+            sums = np.bincount(inverse, weights=values)
+            minimums = np.full(len(unique_keys), np.inf)
+            maximums = np.full(len(unique_keys), -np.inf)
+            np.minimum.at(minimums, inverse, values)
+            np.maximum.at(maximums, inverse, values)
+
+            for i, key in enumerate(unique_keys.tolist()):
+                self._group(key)[field].update_from(int(counts[i]), float(sums[i]),
+                                                    float(minimums[i]), float(maximums[i]))
+
+    def merge(self, other):
+        for key, group in other.groups.items():
+            target = self._group(key)
+            for field, stat in group.items():
+                target[field].merge(stat)
+
+    def summary(self):
+        return {key: {field: stat.summary() for field, stat in group.items()}
+                for key, group in self.groups.items()}
+
+    def to_dict(self):
+        return {key: {field: stat.to_dict() for field, stat in group.items()}
+                for key, group in self.groups.items()}
+
+    def load(self, state):
+        self.groups = {key: {field: RunningStat.from_dict(stat) for field, stat in group.items()}
+                       for key, group in state.items()}
+
+class StatsAggregator:
+    """Mergeable running statistics for player and server events"""
+
+    def __init__(self, relative_accuracy=0.01, max_groups=1000):
+        self.relative_accuracy = relative_accuracy
+        self.max_groups = max_groups
+        self.score = Metric(relative_accuracy)
+        self.cpu_usage = Metric(relative_accuracy)
+        self.memory_usage = Metric(relative_accuracy)
+        self.player_by_server = GroupedStats(["score"], max_groups)
+        self.player_by_action = GroupedStats(["score"], max_groups)
+        self.server_by_server = GroupedStats(["cpu_usage", "memory_usage"], max_groups)
+
+    @staticmethod
+    def _column(events, field):
+        return np.fromiter((event[field] for event in events), dtype=np.float64, count=len(events))
+
+    def update_player_events(self, events):
+        if not events:
+            return
+        scores = self._column(events, "score")
+        self.score.update(scores)
+        self.player_by_server.update([event["server_id"] for event in events], {"score": scores})
+        self.player_by_action.update([event["action"] for event in events], {"score": scores})
+
+    def update_server_events(self, events):
+        if not events:
+            return
+        cpu = self._column(events, "cpu_usage")
+        memory = self._column(events, "memory_usage")
+        self.cpu_usage.update(cpu)
+        self.memory_usage.update(memory)
+        self.server_by_server.update([event["server_id"] for event in events],
+                                     {"cpu_usage": cpu, "memory_usage": memory})
+
+    def merge(self, other):
+        """Fold another replica's aggregates into this one"""
+        self.score.merge(other.score)
+        self.cpu_usage.merge(other.cpu_usage)
+        self.memory_usage.merge(other.memory_usage)
+        self.player_by_server.merge(other.player_by_server)
+        self.player_by_action.merge(other.player_by_action)
+        self.server_by_server.merge(other.server_by_server)
+
+    def legacy_stats(self):
+        """The flat statistics served by GET /statistics"""
+        return {
+            "total_player_events": self.score.stat.count,
+            "total_server_events": self.cpu_usage.stat.count,
+            "max_player_score": int(self.score.stat.maximum or 0),
+            "avg_cpu_usage": self.cpu_usage.stat.mean
+        }
+
+    def summary(self, group_by=None):
+        """Totals, means and percentiles, optionally broken down by server_id or action"""
+        summary = {
+            **self.legacy_stats(),
+            "score": self.score.summary(),
+            "cpu_usage": self.cpu_usage.summary(),
+            "memory_usage": self.memory_usage.summary()
+        }
+        if group_by == "server_id":
+            summary["by_server_id"] = {
+                "player_events": self.player_by_server.summary(),
+                "server_events": self.server_by_server.summary()
+            }
+        elif group_by == "action":
+            summary["by_action"] = self.player_by_action.summary()
+        return summary
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "max_groups": self.max_groups,
+            "score": self.score.to_dict(),
+            "cpu_usage": self.cpu_usage.to_dict(),
+            "memory_usage": self.memory_usage.to_dict(),
+            "player_by_server": self.player_by_server.to_dict(),
+            "player_by_action": self.player_by_action.to_dict(),
+            "server_by_server": self.server_by_server.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        aggregator = cls(state["relative_accuracy"], state["max_groups"])
+        aggregator.score = Metric.from_dict(state["score"])
+        aggregator.cpu_usage = Metric.from_dict(state["cpu_usage"])
+        aggregator.memory_usage = Metric.from_dict(state["memory_usage"])
+        aggregator.player_by_server.load(state["player_by_server"])
+        aggregator.player_by_action.load(state["player_by_action"])
+        aggregator.server_by_server.load(state["server_by_server"])
+        return aggregator
@@ -3,22 +3,33 @@ from connexion import NoContent
 from connexion.middleware import MiddlewarePosition
 from starlette.middleware.cors import CORSMiddleware
 import logging
-import logging.config
 import yaml
-import requests
+import asyncio
+import httpx
+import glob
 import json
+import math
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
+from pykafka import KafkaClient
+from pykafka.common import OffsetType
+from threading import Thread, Lock
+from aggregates import StatsAggregator
+from snapshot import Snapshot
+from event_common.event_stream import EventStream, EventStreamMiddleware
+from event_common.metrics import MetricsMiddleware
+from event_common.log_setup import setup_logging
+from event_common.codec import decode
+from prometheus_client import Counter, Gauge, Histogram
+from windows import WindowAggregator, summarize, to_epoch, to_isoformat
 
 
 SERVICE_NAME = "processing"
 
-# Load logging configuration from YAML
-with open("config/log_conf.yml", "r") as log_file:
-    log_config = yaml.safe_load(log_file)
-    log_config['handlers']['file']['filename'] = f'logs/{SERVICE_NAME}.log'
-    logging.config.dictConfig(log_config)
+# Load logging configuration from YAML; handlers write from a background thread
+setup_logging("config/log_conf.yml", f'logs/{SERVICE_NAME}.log')
 
 logger = logging.getLogger('basicLogger')
 
@@ -29,6 +40,33 @@ with open('config/processing_conf.yml', 'r') as f:
 # JSON file path for storing stats - Fetch from the configuration
 STATS_FILE = app_config['datastore']['filename']  # Updated to use the config value
 
+# Kafka settings used when statistics are streamed instead of polled from storage
+MODE = app_config['mode']
+kafka_config = app_config['events']['kafka']
+KAFKA_HOST = f"{kafka_config['hostname']}:{kafka_config['port']}"
+TOPIC_NAME = kafka_config['topic']
+CONSUMER_GROUP = kafka_config['consumer_group']
+CHECKPOINT_INTERVAL = app_config['events']['checkpoint_interval']
+RETRY_INTERVAL = app_config['events']['retry_interval']
+
+# Settings for the mergeable aggregates
+aggregates_config = app_config['aggregates']
+RELATIVE_ACCURACY = aggregates_config['relative_accuracy']
+MAX_GROUPS = aggregates_config['max_groups']
+BATCH_SIZE = app_config['events']['batch_size']
+
+# Settings for catching up from storage in poll mode
+eventstore_config = app_config['eventstore']
+PAGE_SIZE = eventstore_config['page_size']
+SETTLE_LAG = eventstore_config['settle_lag']
+REQUEST_TIMEOUT = eventstore_config['timeout']
+EVENT_TYPES = ("player", "server")
+
+# Settings for the time-window buckets
+windows_config = app_config['windows']
+WINDOWS_FILE = windows_config['filename']
+GRANULARITIES = windows_config['granularities']
+
 # Default statistics
 default_stats = {
     "total_player_events": 0,
@@ -38,98 +76,408 @@ default_stats = {
     "last_updated": "1970-01-01T00:00:00"
 }
 
+def load_stats():
+    """Reads the persisted statistics, or the defaults if there are none yet or they can't be continued.
+
+    Kafka offsets and storage watermarks track different positions, so a
+    checkpoint written in the other mode would count every event again on
+    top of its totals; it is set aside and everything is recounted instead.
+    """
+    if not os.path.exists(STATS_FILE):
+        return default_stats.copy()
+
+    with open(STATS_FILE, "r") as f:
+        stats = json.load(f)
+
+    if "aggregates" not in stats:
+        # The old flat format kept no sums (avg_cpu_usage was only the latest batch's mean), so nothing in it
+        # can seed the aggregates; both event types are counted again from the start instead
+        logger.warning("Statistics file predates the aggregates, recounting all events")
+        return default_stats.copy()
+
+    saved_mode = stats.get("mode") or ("kafka" if stats.get("kafka_offsets") else "poll")  # Older files lack it
+    if saved_mode != MODE:
+        logger.warning(f"Statistics were checkpointed in {saved_mode} mode, recounting all events in {MODE} mode")
+        return default_stats.copy()
+    return stats
+
+def load_aggregator(stats):
+    """Rebuilds the aggregates from persisted stats"""
+    if "aggregates" in stats:
+        return StatsAggregator.from_dict(stats["aggregates"])
+    return StatsAggregator(RELATIVE_ACCURACY, MAX_GROUPS)
+
+# Statistics held in memory and shared by the updater and the API
+stats_lock = Lock()
+statistics_snapshot = Snapshot()  # GET /statistics
+summary_snapshot = Snapshot()  # GET /stats without group_by
+persisted_stats = load_stats()
+aggregator = load_aggregator(persisted_stats)
+last_updated = persisted_stats["last_updated"]
+kafka_offsets = {int(p): o for p, o in persisted_stats.get("kafka_offsets", {}).items()}
+# Per-type position in storage: rows from start onwards, after cursor if set (older files only have last_updated)
+watermarks = persisted_stats.get("watermarks") or {
+    event_type: {"start": persisted_stats["last_updated"], "cursor": None} for event_type in EVENT_TYPES
+}
+windows = WindowAggregator(GRANULARITIES, windows_config['max_servers'], windows_config['max_future_seconds'])
+# Each checkpoint writes its own windows file and stats.json names it (older files used WINDOWS_FILE directly)
+windows_file = persisted_stats.get("windows_file", WINDOWS_FILE if "aggregates" in persisted_stats else None)
+if windows_file:
+    windows.load(windows_file)
+checkpoint_lock = Lock()  # One checkpoint written at a time
+checkpoint_sequence = persisted_stats.get("checkpoint", 0)
+last_checkpoint = time.monotonic()
+
+def publish_snapshots():
+    """Re-serialises the responses dashboards poll; caller holds stats_lock"""
+    statistics_snapshot.publish({**aggregator.legacy_stats(), "last_updated": last_updated})
+    summary_snapshot.publish({**aggregator.summary(), "last_updated": last_updated})
+
+def windows_filename(sequence):
+    base, extension = os.path.splitext(WINDOWS_FILE)
+    return f"{base}.{sequence}{extension}"
+
+def save_stats():
+    """Checkpoints the statistics, aggregates, consumed offsets and time windows; caller must not hold stats_lock.
+
+    The state is copied under stats_lock and written outside it. The windows
+    go to a new file first and stats.json, replaced last, names it, so a
+    restart always loads stats and windows from the same checkpoint.
+    """
+    global windows_file, checkpoint_sequence, last_checkpoint
+
+    with checkpoint_lock:
+        with stats_lock:
+            stats = {
+                **aggregator.legacy_stats(),
+                "last_updated": last_updated,
+                "mode": MODE,
+                "kafka_offsets": {str(p): o for p, o in kafka_offsets.items()},
+                "watermarks": dict(watermarks),
+                "aggregates": aggregator.to_dict()
+            }
+            arrays = windows.snapshot()
+
+        checkpoint_sequence += 1
+        new_windows_file = windows_filename(checkpoint_sequence)
+        windows.save(new_windows_file, arrays)
+        stats.update({"checkpoint": checkpoint_sequence, "windows_file": new_windows_file})
+
+        # Write to a temp file and rename over the old one so a crash never leaves a half-written file
+        tmp_filename = f"{STATS_FILE}.tmp"
+        with open(tmp_filename, "w") as f:
+            json.dump(stats, f)
+        os.replace(tmp_filename, STATS_FILE)
+        windows_file = new_windows_file
+
+        # Earlier checkpoints' windows, including any a crash left unreferenced, are no longer needed
+        base, extension = os.path.splitext(WINDOWS_FILE)
+        for stale in glob.glob(f"{base}.*{extension}") + [WINDOWS_FILE]:
+            if stale != windows_file and os.path.exists(stale):
+                os.remove(stale)
+        last_checkpoint = time.monotonic()
+
+# Serve what was persisted until the first update; with no file GET /statistics stays 404
+if os.path.exists(STATS_FILE):
+    publish_snapshots()
+
 # Function to get statistics
 def get_statistics():
-    """Returns the latest statistics from the JSON file."""
+    """Returns the latest statistics."""
     logger.info("Received request for statistics.")
 
-    if not os.path.exists(STATS_FILE):
+    response = statistics_snapshot.response()
+    if response is None:
         logger.error("Statistics file not found.")
-        return {"message": "Statistics do not exist"}, 404  # Return 404 if file doesn't exist
+        return {"message": "Statistics do not exist"}, 404  # Return 404 if nothing has been processed yet
+
+    logger.info("Request completed successfully.")
+    return response
+
+def get_stats(group_by=None):
+    """Returns means, percentiles and optional per-server or per-action breakdowns."""
+    if group_by is None and summary_snapshot.ready:
+        return summary_snapshot.response()
+
+    with stats_lock:
+        stats = {**aggregator.summary(group_by), "last_updated": last_updated}
+    return stats, 200
+
+def get_stats_state():
+    """Returns the raw mergeable aggregates so another replica or tool can combine them."""
+    with stats_lock:
+        state = {"last_updated": last_updated, "aggregates": aggregator.to_dict()}
+    return state, 200
+
+def get_stat_windows(granularity, from_=None, to=None, server_id=None):
+    """Returns precomputed time buckets, e.g. events per minute for a server, without querying storage."""
+    if granularity not in GRANULARITIES:
+        return {"message": f"Unknown granularity {granularity}, expected one of {list(GRANULARITIES)}"}, 400
 
-    # If file exists, read the stats
     try:
-        with open(STATS_FILE, "r") as f:
-            stats = json.load(f)
-        logger.debug(f"Current statistics: {stats}")
-        logger.info("Request completed successfully.")
-        return stats, 200  # Return stats with 200 status code
-    except Exception as e:
-        logger.error(f"Error reading statistics file: {e}")
-        return {"message": "Internal server error"}, 500  # Return 500 if there's an error reading the file
+        start = to_epoch(from_) if from_ else None
+        end = to_epoch(to) if to else None
+    except (ValueError, OverflowError) as e:
+        return {"message": f"Invalid time range: {e}"}, 400
+
+    with stats_lock:
+        buckets = windows.query(granularity, start, end, server_id)
+
+    return {
+        "granularity": granularity,
+        "from": to_isoformat(start) if start is not None else None,
+        "to": to_isoformat(end) if end is not None else None,
+        "server_id": server_id,
+        "summary": summarize(buckets),
+        "buckets": buckets
+    }, 200
+
+# Hot-path metrics served at /metrics
+TICK_DURATION = Histogram("scheduler_tick_duration_seconds", "Time taken by one populate_stats run",
+                          buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+FETCH_LATENCY = Histogram("storage_fetch_duration_seconds", "Time to fetch one page of events from storage",
+                          ["event_type"])
+EVENTS_PROCESSED = Counter("events_processed_total", "Events folded into the statistics", ["event_type"])
+MESSAGES_CONSUMED = Counter("kafka_messages_consumed_total", "Messages read from the events topic")
+Gauge("window_future_events_dropped", "Events left out of the time windows for being dated too far ahead").set_function(
+    lambda: windows.future_dropped)
+
+def apply_player_events(events):
+    EVENTS_PROCESSED.labels("player").inc(len(events))
+    aggregator.update_player_events(events)
+    windows.update_player_events(events)
+
+def apply_server_events(events):
+    EVENTS_PROCESSED.labels("server").inc(len(events))
+    aggregator.update_server_events(events)
+    windows.update_server_events(events)
+
+update_events = {"player": apply_player_events, "server": apply_server_events}
+
+async def catch_up(client, event_type, end_timestamp):
+    """Pages through one event type up to end_timestamp, folding in each page and checkpointing on a timer"""
+    global last_updated
 
+    pages = 0
+    while True:
+        watermark = watermarks[event_type]
+        if not watermark["cursor"] and watermark["start"] >= end_timestamp:
+            return pages  # Already caught up to the settled edge
+
+        params = {
+            "start_timestamp": watermark["start"],
+            "end_timestamp": end_timestamp,
+            "limit": PAGE_SIZE
+        }
+        if watermark["cursor"]:
+            params["cursor"] = watermark["cursor"]
+
+        start = time.perf_counter()
+        response = await client.get(f"/{event_type}", params=params)
+        FETCH_LATENCY.labels(event_type).observe(time.perf_counter() - start)
+        if response.status_code != 200:
+            logger.error(f"Failed to fetch {event_type} events, status code: {response.status_code}")
+            return pages
+
+        events = response.json()
+        next_cursor = response.headers.get("X-Next-Cursor")
+        last_cursor = response.headers.get("X-Last-Cursor")
+
+        # The watermark moves to the (date_created, id) of the last row counted, as stamped by storage, never
+        # to this host's clock, so a row committed later with a date_created before end_timestamp isn't skipped
+        with stats_lock:
+            update_events[event_type](events)
+            if events and last_cursor:
+                last_created = to_isoformat(to_epoch(events[-1]["date_created"]))
+                watermarks[event_type] = {"start": last_created, "cursor": last_cursor}
+            last_updated = datetime.utcnow().isoformat()
+            publish_snapshots()
+
+        if time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+            save_stats()
+
+        pages += 1
+        logger.info(f"Processed page {pages} of {len(events)} {event_type} events.")
+        if not next_cursor:
+            return pages
+
+async def fetch_all(end_timestamp):
+    """Catches up both event types concurrently over one pooled HTTP client"""
+    async with httpx.AsyncClient(base_url=app_config['eventstore']['url'], timeout=REQUEST_TIMEOUT,
+                                 limits=httpx.Limits(max_connections=len(EVENT_TYPES))) as client:
+        return await asyncio.gather(*(catch_up(client, event_type, end_timestamp) for event_type in EVENT_TYPES))
 
 # Function to update statistics periodically
 def populate_stats():
     """Fetches new events from storage and updates statistics."""
     logger.info("Starting periodic processing of statistics...")
 
-    # Read current statistics from JSON file
-    if os.path.exists(STATS_FILE):
-        with open(STATS_FILE, "r") as f:
-            stats = json.load(f)
-    else:
-        stats = default_stats.copy()
-
-    last_updated = stats.get("last_updated", "1970-01-01T00:00:00")
-    start_timestamp = last_updated
-    end_timestamp = datetime.utcnow().isoformat()
-
-    # Query storage service for new events
-    player_events_url = f"{app_config['eventstore']['url']}/player?start_timestamp={start_timestamp}&end_timestamp={end_timestamp}"
-    server_events_url = f"{app_config['eventstore']['url']}/server?start_timestamp={start_timestamp}&end_timestamp={end_timestamp}"
+    # Rows are stamped with the storage transaction's start time, so stay SETTLE_LAG behind
+    # now to let in-flight inserts commit before their range is read
+    end_timestamp = (datetime.utcnow() - timedelta(seconds=SETTLE_LAG)).isoformat()
 
     try:
-        player_resp = requests.get(player_events_url)
-        server_resp = requests.get(server_events_url)
-
-        # Check if the responses were successful
-        if player_resp.status_code != 200:
-            logger.error(f"Failed to fetch player events, status code: {player_resp.status_code}")
-            return
-        if server_resp.status_code != 200:
-            logger.error(f"Failed to fetch server events, status code: {server_resp.status_code}")
-            return
-
-        player_events = player_resp.json()
-        server_events = server_resp.json()
-
-        logger.info(f"Received {len(player_events)} new player events.")
-        logger.info(f"Received {len(server_events)} new server events.")
-
-        # Calculate updated statistics
-        if player_events:
-            stats["total_player_events"] += len(player_events)
-            stats["max_player_score"] = max(
-                stats["max_player_score"], 
-                max(event["score"] for event in player_events)
-            )
-
-        if server_events:
-            stats["total_server_events"] += len(server_events)
-            stats["avg_cpu_usage"] = sum(event["cpu_usage"] for event in server_events) / len(server_events)
-
-        # Update the last_updated timestamp
-        stats["last_updated"] = end_timestamp
-
-        # Write updated stats to JSON file
-        with open(STATS_FILE, "w") as f:
-            json.dump(stats, f, indent=4)
-
-        logger.debug(f"Updated stats: {stats}")
+        with TICK_DURATION.time():
+            pages = asyncio.run(fetch_all(end_timestamp))
+            if any(pages):
+                save_stats()  # Checkpoint where the run stopped, whatever the timer says
+        if logger.isEnabledFor(logging.DEBUG):  # legacy_stats() walks every metric, skip it when nobody reads it
+            logger.debug("Fetched %s pages, updated stats: %s", dict(zip(EVENT_TYPES, pages)), aggregator.legacy_stats())
     except Exception as e:
         logger.error(f"Error occurred while fetching or processing events: {e}")
 
     logger.info("Finished periodic processing of statistics.")
 
+def seek_target(offset):
+    """pykafka resets to the last consumed offset, so step back one; -1 would mean LATEST"""
+    return offset - 1 if offset > 0 else OffsetType.EARLIEST
+
+# Fields the aggregates and windows read from each Kafka payload: numeric ones, then keys grouped on
+EVENT_FIELDS = {
+    "player_event": (("score",), ("server_id", "action")),
+    "server_event": (("cpu_usage", "memory_usage"), ("server_id",))
+}
+
+def checked_event(msg_json):
+    """The payload of a decoded message with every field the stats read converted and checked.
+
+    Raises ValueError, KeyError or TypeError for anything that would otherwise
+    fail inside the shared update and leave the consumer retrying that message.
+    """
+    if not isinstance(msg_json, dict) or not isinstance(msg_json.get("payload"), dict):
+        raise TypeError("message and its payload must be objects")
+    numeric, keys = EVENT_FIELDS[msg_json["type"]]
+    event = dict(msg_json["payload"])
+    for field in numeric:
+        event[field] = float(event[field])
+        if not math.isfinite(event[field]):
+            raise ValueError(f"{field} is not a finite number")
+    for field in keys:
+        event[field] = str(event[field])
+    to_epoch(event["timestamp"])  # Windows bucket on it
+    return event
+
+def apply_batch(batch):
+    """Folds a batch of consumed messages into the aggregates and advances the offsets"""
+    global last_updated
+
+    MESSAGES_CONSUMED.inc(len(batch))
+    player_events = []
+    server_events = []
+    for msg in batch:
+        try:
+            msg_json = decode(msg.value)
+            event = checked_event(msg_json)
+            if msg_json["type"] == "player_event":
+                player_events.append(event)
+            else:
+                server_events.append(event)
+        except (ValueError, KeyError, TypeError, OverflowError) as e:
+            logger.error("Skipping unusable message at partition %s offset %s: %s", msg.partition_id, msg.offset, e)
+
+    with stats_lock:
+        apply_player_events(player_events)
+        apply_server_events(server_events)
+        for msg in batch:
+            kafka_offsets[msg.partition_id] = msg.offset + 1
+        last_updated = datetime.utcnow().isoformat()
+        publish_snapshots()
+
+def make_consumer():
+    """Connect to the events topic, positioned at the offsets already folded into the stats"""
+    client = KafkaClient(hosts=KAFKA_HOST)
+    topic = client.topics[str.encode(TOPIC_NAME)]
+    consumer = topic.get_simple_consumer(
+        consumer_group=CONSUMER_GROUP.encode(),
+        reset_offset_on_start=True,
+        auto_offset_reset=OffsetType.EARLIEST,
+        consumer_timeout_ms=1000
+    )
+
+    # Resume from the offsets applied so far (saved with the stats at startup) so each event is counted exactly once
+    with stats_lock:
+        offsets = dict(kafka_offsets)
+    if offsets:
+        consumer.reset_offsets([
+            (consumer.partitions[partition_id], seek_target(offset))
+            for partition_id, offset in offsets.items()
+            if partition_id in consumer.partitions
+        ])
+    return consumer, offsets
+
+def consume_events():
+    """Updates statistics from the events topic, reconnecting whenever Kafka is unreachable or the consumer fails"""
+    with stats_lock:
+        publish_snapshots()
+
+    while True:
+        try:
+            consumer, offsets = make_consumer()
+        except Exception as e:
+            logger.error(f"Could not connect to the events topic, retrying in {RETRY_INTERVAL}s: {e}")
+            time.sleep(RETRY_INTERVAL)
+            continue
+
+        logger.info(f"Kafka stats consumer started at offsets {offsets or 'earliest'}")
+
+        try:
+            consume_loop(consumer)
+        except Exception as e:
+            # Messages of an unapplied batch never advanced kafka_offsets, so the new consumer reads them again
+            logger.error(f"Kafka stats consumer failed, reconnecting in {RETRY_INTERVAL}s: {e}")
+            try:
+                consumer.stop()
+            except Exception:
+                pass
+            time.sleep(RETRY_INTERVAL)
+
+def consume_loop(consumer):
+    """Folds consumed messages into the stats in small batches, checkpointing offsets with the stats"""
+    last_checkpoint = time.monotonic()
+    batch = []
+
+    while True:
+        # Drain what has already arrived, up to BATCH_SIZE, then apply it in one update
+        msg = consumer.consume(block=not batch)
+        if msg is not None:
+            batch.append(msg)
+        if batch and (msg is None or len(batch) >= BATCH_SIZE):
+            apply_batch(batch)
+            batch = []
+
+        if time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+            save_stats()
+            consumer.commit_offsets()  # Mirror the checkpoint in the consumer group for lag tooling
+            last_checkpoint = time.monotonic()
+
+def setup_kafka_thread():
+    consumer_thread = Thread(target=consume_events)
+    consumer_thread.daemon = True
+    consumer_thread.start()
+
 # Function to initialize the scheduler
 def init_scheduler():
     """Sets up a periodic task to update statistics."""
     sched = BackgroundScheduler(daemon=True)
-    sched.add_job(populate_stats, 'interval', seconds=app_config['scheduler']['interval'])
+    # One run at a time; ticks missed while a long catch-up runs collapse into a single run
+    sched.add_job(populate_stats, 'interval', seconds=app_config['scheduler']['interval'],
+                  max_instances=1, coalesce=True)
     sched.start()
     logger.info("Scheduler initialized and running")
 
+# Dashboards subscribe here instead of polling GET /statistics
+stream_config = app_config['stream']
+stats_stream = EventStream(
+    lambda: statistics_snapshot.data,
+    interval=stream_config['interval'],
+    keepalive=stream_config['keepalive'],
+    max_clients=stream_config['max_clients'],
+    queue_size=stream_config['queue_size']
+)
+
+Gauge("stream_clients", "Dashboards connected to /statistics/stream").set_function(
+    lambda: stats_stream.metrics()["clients"])
+
 # Create the connexion app
 app = connexion.FlaskApp(__name__, specification_dir='')
 app.add_middleware(
@@ -140,13 +488,24 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(
+    EventStreamMiddleware,
+    position=MiddlewarePosition.BEFORE_EXCEPTION,
+    path="/statistics/stream",
+    stream=stats_stream,
+)
+app.add_middleware(MetricsMiddleware, position=MiddlewarePosition.BEFORE_EXCEPTION)
 
 # Add the API specification
-app.add_api("ACIT3855-ProjectProcessing.yaml", strict_validation=True, validate_responses=True)
+app.add_api("ACIT3855-ProjectProcessing.yaml", strict_validation=True, validate_responses=True,
+            pythonic_params=True)  # Exposes the "from" query parameter as from_
 
 # Run the app
 if __name__ == "__main__":
-    init_scheduler()  # Start periodic statistics update
+    if MODE == "kafka":
+        setup_kafka_thread()  # Stream statistics straight from the events topic
+    else:
+        init_scheduler()  # Start periodic statistics update
     logger.info("Starting Processing Service on port 8100")
     app.run(port=8100, host="0.0.0.0")
 
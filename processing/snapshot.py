@@ -0,0 +1,42 @@
+import hashlib
+import json
+from flask import Response, request
+
+
+class Snapshot:
+    """A JSON document serialised once per update and served as-is to every reader.
+
+    publish() builds the body and its ETag and swaps them in with a single
+    reference assignment, so readers never see a half-built snapshot and need
+    no lock. response() answers If-None-Match with 304 Not Modified.
+    """
+
+    def __init__(self):
+        self._current = None  # (data, body, etag)
+
+    def publish(self, data):
+        body = json.dumps(data).encode("utf-8")
+        etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+        self._current = (data, body, etag)
+
+    @property
+    def ready(self):
+        return self._current is not None
+
+    @property
+    def data(self):
+        """The published document itself, for in-process consumers such as the event stream"""
+        current = self._current
+        return current[0] if current is not None else None
+
+    def response(self):
+        """The snapshot as a conditional response for the current request, or None if nothing is published"""
+        current = self._current
+        if current is None:
+            return None
+
+        _, body, etag = current
+        response = Response(body, mimetype="application/json")
+        response.set_etag(etag)
+        response.cache_control.no_cache = True  # Clients may cache but must revalidate with the ETag
+        return response.make_conditional(request)
@@ -0,0 +1,227 @@
+import os
+import time
+from datetime import datetime, timezone
+import numpy as np
+from dateutil import parser
+
+
+ALL_SERVERS = "__all__"
+OTHER_GROUP = "__other__"
+
+COUNTS = ("player_events", "server_events")
+VALUES = ("score", "cpu_usage", "memory_usage")
+
+def to_epoch(value):
+    """Seconds since the epoch for an event timestamp; naive timestamps are taken as UTC"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        moment = parser.isoparse(value)
+    except ValueError:
+        moment = parser.parse(value)  # Flask serialises datetimes as RFC 822 dates
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+def to_isoformat(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None).isoformat()
+
+def summarize(buckets):
+    """Totals and event-weighted averages across a list of buckets, e.g. a rolling 5 minute CPU average"""
+    summary = {name: sum(bucket[name] for bucket in buckets) for name in COUNTS}
+    for name in VALUES:
+        count_name = "player_events" if name == "score" else "server_events"
+        weighted = [(bucket[f"avg_{name}"], bucket[count_name]) for bucket in buckets if bucket[count_name]]
+        summary[f"avg_{name}"] = sum(avg * count for avg, count in weighted) / summary[count_name] if weighted else None
+        summary[f"max_{name}"] = max((bucket[f"max_{name}"] for bucket in buckets if bucket[count_name]), default=None)
+    return summary
+
+class WindowRing:
+    """Fixed-width time buckets in a ring of preallocated NumPy arrays.
+
+    Bucket i covers [start, start + width) and lives in slot
+    (start // width) % slots, so the ring always holds the most recent
+    `slots` buckets. A slot is cleared when a newer bucket claims it and
+    events for buckets that have already rotated out are dropped.
+    """
+
+    def __init__(self, width, slots):
+        self.width = width
+        self.slots = slots
+        self.starts = np.full(slots, -1, dtype=np.int64)
+        self.counts = np.zeros((slots, len(COUNTS)), dtype=np.int64)
+        self.sums = np.zeros((slots, len(VALUES)), dtype=np.float64)
+        self.maxes = np.full((slots, len(VALUES)), -np.inf, dtype=np.float64)
+        self.latest = -1
+        self.dropped = 0
+
+    def update(self, kind, epochs, columns):
+        """Add events of one kind; epochs is an int array and columns maps value name -> float array"""
+        if epochs.size == 0:
+            return
+
+        bucket_starts = epochs - epochs % self.width
+        unique_starts, inverse = np.unique(bucket_starts, return_inverse=True)
+        self.latest = max(self.latest, int(unique_starts[-1]))
+
+        slots = (unique_starts // self.width) % self.slots
+        current = self.starts[slots]
+        live = (unique_starts > self.latest - self.width * self.slots) & (current <= unique_starts)
+
+        # Claim slots still holding an older bucket
+        reset = slots[live & (current < unique_starts)]
+        self.starts[reset] = unique_starts[live & (current < unique_starts)]
+        self.counts[reset] = 0
+        self.sums[reset] = 0.0
+        self.maxes[reset] = -np.inf
+
+        keep = live[inverse]
+        self.dropped += int(np.count_nonzero(~keep))
+        event_slots = slots[inverse][keep]
+
+        np.add.at(self.counts[:, COUNTS.index(kind)], event_slots, 1)
+        for name, values in columns.items():
+            column = VALUES.index(name)
+            np.add.at(self.sums[:, column], event_slots, values[keep])
+            np.maximum.at(self.maxes[:, column], event_slots, values[keep])
+
+    def query(self, start=None, end=None):
+        """Buckets with data whose start falls in [start, end), oldest first"""
+        mask = self.starts >= 0
+        if start is not None:
+            mask &= self.starts >= start - start % self.width
+        if end is not None:
+            mask &= self.starts < end
+
+        selected = np.flatnonzero(mask)
+        selected = selected[np.argsort(self.starts[selected])]
+        return [self._bucket(slot) for slot in selected.tolist()]
+
+    def _bucket(self, slot):
+        counts = dict(zip(COUNTS, self.counts[slot].tolist()))
+        bucket = {"start": to_isoformat(int(self.starts[slot])), **counts}
+        for column, name in enumerate(VALUES):
+            count = counts["player_events"] if name == "score" else counts["server_events"]
+            bucket[f"avg_{name}"] = float(self.sums[slot, column] / count) if count else None
+            bucket[f"max_{name}"] = float(self.maxes[slot, column]) if count else None
+        return bucket
+
+    def arrays(self):
+        return {"starts": self.starts, "counts": self.counts, "sums": self.sums, "maxes": self.maxes}
+
+    def restore(self, arrays, max_start=None):
+        """Load saved arrays, clearing any bucket starting after max_start (left by a far-future event)"""
+        if arrays["starts"].shape != self.starts.shape:
+            return False  # Ring size changed in config, start over
+        self.starts = arrays["starts"]
+        self.counts = arrays["counts"]
+        self.sums = arrays["sums"]
+        self.maxes = arrays["maxes"]
+        if max_start is not None:
+            future = self.starts > max_start
+            self.starts[future] = -1
+            self.counts[future] = 0
+            self.sums[future] = 0.0
+            self.maxes[future] = -np.inf
+        self.latest = int(self.starts.max())
+        return True
+
+class WindowAggregator:
+    """Per-granularity rings for all servers combined and for each server id.
+
+    granularities maps a name such as "1m" to {"width": seconds, "slots": n}.
+    At most max_servers ids get their own rings; the rest share "__other__".
+    Timestamps come from clients, so events more than max_future seconds
+    ahead of the clock are dropped rather than allowed to rotate every ring
+    past the real events.
+    """
+
+    def __init__(self, granularities, max_servers, max_future=300):
+        self.granularities = granularities
+        self.max_servers = max_servers
+        self.max_future = max_future
+        self.future_dropped = 0
+        self.rings = {name: {} for name in granularities}
+
+    def _ring(self, granularity, server_id):
+        rings = self.rings[granularity]
+        if server_id not in rings:
+            if server_id != ALL_SERVERS and len(rings) > self.max_servers:
+                server_id = OTHER_GROUP
+            if server_id not in rings:
+                config = self.granularities[granularity]
+                rings[server_id] = WindowRing(config["width"], config["slots"])
+        return rings[server_id]
+
+    def _update(self, kind, events, fields):
+        if not events:
+            return
+        epochs = np.fromiter((to_epoch(event["timestamp"]) for event in events), dtype=np.int64, count=len(events))
+        current = epochs <= time.time() + self.max_future
+        if not current.all():
+            self.future_dropped += int(np.count_nonzero(~current))
+            events = [event for event, keep in zip(events, current.tolist()) if keep]
+            epochs = epochs[current]
+            if not events:
+                return
+        columns = {field: np.fromiter((event[field] for event in events), dtype=np.float64, count=len(events))
+                   for field in fields}
+        server_ids = np.asarray([str(event["server_id"]) for event in events], dtype=object)
+        unique_ids, inverse = np.unique(server_ids, return_inverse=True)
+        # Row indices of each server's events, in one pass rather than a mask per server
+        groups = np.split(np.argsort(inverse, kind="stable"), np.cumsum(np.bincount(inverse))[:-1])
+
+        for granularity in self.granularities:
+            self._ring(granularity, ALL_SERVERS).update(kind, epochs, columns)
+            for server_id, rows in zip(unique_ids.tolist(), groups):
+                self._ring(granularity, server_id).update(
+                    kind, epochs[rows], {field: values[rows] for field, values in columns.items()})
+
+    def update_player_events(self, events):
+        self._update("player_events", events, ("score",))
+
+    def update_server_events(self, events):
+        self._update("server_events", events, ("cpu_usage", "memory_usage"))
+
+    def query(self, granularity, start=None, end=None, server_id=None):
+        """Precomputed buckets for one granularity, optionally for a single server"""
+        ring = self.rings[granularity].get(server_id or ALL_SERVERS)
+        if ring is None:
+            return []
+        return ring.query(start, end)
+
+    def snapshot(self):
+        """Copies of every ring's arrays, keyed as save() writes them, for writing once the caller's lock is released"""
+        arrays = {}
+        for granularity, rings in self.rings.items():
+            for server_id, ring in rings.items():
+                for name, array in ring.arrays().items():
+                    arrays[f"{granularity}|{server_id}|{name}"] = array.copy()
+        return arrays
+
+    def save(self, filename, arrays=None):
+        """Write every ring, or a snapshot() taken earlier, to a compressed .npz via a temp file so a crash can't corrupt it"""
+        if arrays is None:
+            arrays = self.snapshot()
+
+        tmp_filename = f"{filename}.tmp.npz"
+        np.savez_compressed(tmp_filename, **arrays)
+        os.replace(tmp_filename, filename)
+
+    def load(self, filename):
+        """Restore rings written by save(); granularities no longer configured are ignored"""
+        if not os.path.exists(filename):
+            return
+
+        grouped = {}
+        with np.load(filename) as data:
+            for key in data.files:
+                granularity, server_id, name = key.split("|")
+                grouped.setdefault((granularity, server_id), {})[name] = data[key]
+
+        for (granularity, server_id), arrays in grouped.items():
+            if granularity in self.granularities:
+                config = self.granularities[granularity]
+                ring = WindowRing(config["width"], config["slots"])
+                if ring.restore(arrays, time.time() + self.max_future):
+                    self.rings[granularity][server_id] = ring
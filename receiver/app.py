@@ -5,21 +5,30 @@ import httpx
 import uuid
 import yaml
 import logging
-import logging.config
 import datetime
-import json
+import atexit
+import queue
+import time
 from pykafka import KafkaClient
+from pykafka.common import CompressionType
+from pykafka.exceptions import ProducerQueueFullError
+from flask import request
+from jsonschema import Draft4Validator
+from connexion.middleware import MiddlewarePosition
+from prometheus_client import Counter, Histogram
+from ndjson import NDJSON_MIMETYPE, VALIDATOR_MAP, parse_ndjson
+from event_common.metrics import MetricsMiddleware
+from event_common.log_setup import setup_logging
+from event_common.codec import encode
 
 
 SERVICE_NAME = "receiver"
 
-# Load logging configuration from YAML
-with open("config/log_conf.yml", "r") as log_file:
-    log_config = yaml.safe_load(log_file)
-    log_config['handlers']['file']['filename'] = f'logs/{SERVICE_NAME}.log'
-    logging.config.dictConfig(log_config)
+# Load logging configuration from YAML; handlers write from a background thread
+setup_logging("config/log_conf.yml", f'logs/{SERVICE_NAME}.log')
 
 logger = logging.getLogger('basicLogger')
+event_logger = logging.getLogger('basicLogger.events')  # Sampled per-event messages
 
 # Load the app configuration from the YAML file
 with open('config/receiver_conf.yml', 'r') as f:
@@ -29,21 +38,91 @@ with open('config/receiver_conf.yml', 'r') as f:
 KAFKA_HOST = f"{app_config['events']['kafka']['hostname']}:{app_config['events']['kafka']['port']}"
 TOPIC_NAME = app_config["events"]["kafka"]["topic"]
 
+# Extract producer settings from the config
+producer_config = app_config['events']['kafka']['producer']
+RETRY_AFTER = producer_config['retry_after']
+ACK_TIMEOUT = producer_config['ack_timeout']
+WIRE_FORMAT = app_config['events']['kafka']['wire_format']
+
 # Initialize Kafka client
 client = KafkaClient(hosts=KAFKA_HOST)
 topic = client.topics[str.encode(TOPIC_NAME)]
-producer = topic.get_sync_producer()
 
-def send_event_to_kafka(event_type, event_data):
-    """Publishes an event to Kafka"""
+def make_producer():
+    """Creates a sync producer, or a batching async producer with a bounded queue"""
+    if producer_config['mode'] == 'sync':
+        return topic.get_sync_producer()
+
+    return topic.get_producer(
+        sync=False,
+        linger_ms=producer_config['linger_ms'],
+        min_queued_messages=producer_config['batch_size'],
+        max_queued_messages=producer_config['max_queued_messages'],
+        block_on_queue_full=False,  # Raise ProducerQueueFullError so requests can be shed
+        compression=getattr(CompressionType, producer_config['compression'].upper())
+    )
+
+producer = make_producer()
+
+MAX_BATCH_SIZE = app_config['events']['batch']['max_events']
+
+def make_batch_producer():
+    """In sync mode, an async producer with delivery reports so a batch is enqueued whole and acknowledged together"""
+    if producer_config['mode'] != 'sync':
+        return None  # The async producer already batches
+
+    return topic.get_producer(
+        sync=False,
+        delivery_reports=True,  # Reports are per thread, so each request only sees its own
+        linger_ms=producer_config['linger_ms'],
+        min_queued_messages=MAX_BATCH_SIZE,
+        max_queued_messages=producer_config['max_queued_messages'],
+        block_on_queue_full=False,
+        compression=getattr(CompressionType, producer_config['compression'].upper())
+    )
+
+batch_producer = make_batch_producer()
+
+def stop_producer():
+    """Flushes any queued messages to Kafka before the process exits"""
+    logger.info("Flushing Kafka producer...")
+    producer.stop()
+    if batch_producer is not None:
+        batch_producer.stop()
+
+atexit.register(stop_producer)
+
+# Hot-path metrics served at /metrics
+EVENTS_PRODUCED = Counter("kafka_messages_produced_total", "Events handed to the Kafka producer", ["event_type"])
+EVENTS_REJECTED = Counter("kafka_produce_rejected_total", "Events shed because the producer queue was full", ["event_type"])
+PRODUCE_LATENCY = Histogram("kafka_produce_duration_seconds", "Time to hand one event to the producer",
+                            buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1))
+BATCH_EVENTS = Histogram("batch_request_events", "Events per batch request",
+                         buckets=(1, 10, 50, 100, 250, 500, 1000))
+
+def send_event_to_kafka(event_type, event_data, target=None):
+    """Publishes an event to Kafka, through target instead of the default producer if given, returning the message"""
     msg = {
         "type": event_type,
         "datetime": datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
         "payload": event_data
     }
-    msg_str = json.dumps(msg)
-    producer.produce(msg_str.encode("utf-8"))
-    logger.info(f"Produced event to Kafka: {msg}")
+    msg_bytes = encode(msg, WIRE_FORMAT)
+    start = time.perf_counter()
+    try:
+        message = (target or producer).produce(msg_bytes)
+    except ProducerQueueFullError:
+        EVENTS_REJECTED.labels(event_type).inc()
+        raise
+    PRODUCE_LATENCY.observe(time.perf_counter() - start)
+    EVENTS_PRODUCED.labels(event_type).inc()
+    event_logger.debug("Produced %s to Kafka", event_type, extra={"trace_id": event_data['trace_id']})
+    return message
+
+def queue_full_response(trace_id):
+    """Sheds load with a 503 when the producer's in-flight queue is full"""
+    logger.warning("Kafka producer queue full, rejecting event", extra={"trace_id": trace_id})
+    return {"message": "Event queue is full, retry later"}, 503, {"Retry-After": str(RETRY_AFTER)}
 
 # Extract the event URLs from the config
 PLAYER_EVENT_URL = app_config['events']['player']['url']
@@ -64,8 +143,11 @@ def receive_player_event(body):
     }
     
     # Log that an event was received with the trace ID
-    logger.info(f"Received Player event; Trace Id:{trace_id}")    
-    send_event_to_kafka("player_event", event_data)
+    event_logger.info("Received Player event", extra={"trace_id": trace_id})
+    try:
+        send_event_to_kafka("player_event", event_data)
+    except ProducerQueueFullError:
+        return queue_full_response(trace_id)
 
     # Return the appropriate response based on the result from the storage service
     return NoContent, 201
@@ -85,17 +167,113 @@ def receive_server_event(body):
     }
 
     # Log that an event was received with the trace ID
-    logger.info(f"Received Storage event; Trace Id:{trace_id}")
-    send_event_to_kafka("server_event", event_data)
+    event_logger.info("Received Server event", extra={"trace_id": trace_id})
+    try:
+        send_event_to_kafka("server_event", event_data)
+    except ProducerQueueFullError:
+        return queue_full_response(trace_id)
     
     # Return the appropriate response based on the result from the storage service
     return NoContent, 201
 
+# Load the event schemas from the spec so batch items are checked against the same contract
+with open('ACIT3855-ProjectReceiver.yaml', 'r') as f:
+    event_schemas = yaml.safe_load(f.read())['components']['schemas']
+
+EVENT_VALIDATORS = {
+    "player_event": Draft4Validator(event_schemas['PlayerActivityEvent'], format_checker=Draft4Validator.FORMAT_CHECKER),
+    "server_event": Draft4Validator(event_schemas['ServerPerformanceEvent'], format_checker=Draft4Validator.FORMAT_CHECKER)
+}
+
+def confirm_deliveries(pending, results):
+    """Waits up to ACK_TIMEOUT for the batch producer's delivery reports, turning failed or unconfirmed events into 503s.
+
+    pending maps id() of each produced message to its index in results.
+    Returns how many events were not confirmed.
+    """
+    deadline = time.monotonic() + ACK_TIMEOUT
+    failed = {}
+    while pending:
+        try:
+            message, error = batch_producer.get_delivery_report(timeout=max(deadline - time.monotonic(), 0))
+        except queue.Empty:
+            break
+        index = pending.pop(id(message), None)  # Reports left over from an earlier timed-out request are ignored
+        if index is not None and error is not None:
+            failed[index] = f"Kafka did not accept the event: {error}"
+    failed.update({index: "Kafka did not confirm the event in time, retry later" for index in pending.values()})
+
+    for index, message in failed.items():
+        logger.warning(message, extra={"trace_id": results[index]["trace_id"]})
+        results[index] = {"index": results[index]["index"], "status": 503, "message": message}
+    return len(failed)
+
+def receive_event_batch(event_type, body):
+    """Validates a batch of events, produces the valid ones and reports a status per item"""
+    if request.mimetype == NDJSON_MIMETYPE:
+        try:
+            body = parse_ndjson(body or b"")
+        except ValueError as e:
+            logger.error(f"Malformed NDJSON {event_type} batch: {e}")
+            return {"message": f"Malformed NDJSON: {e}"}, 400
+
+    if len(body) > MAX_BATCH_SIZE:
+        logger.error(f"Rejected {event_type} batch of {len(body)} events (max {MAX_BATCH_SIZE})")
+        return {"message": f"Batch exceeds the maximum of {MAX_BATCH_SIZE} events"}, 413
+
+    BATCH_EVENTS.observe(len(body))
+    validator = EVENT_VALIDATORS[event_type]
+    fields = validator.schema['properties']
+    results = []
+    accepted = 0
+    sent = []  # Keeps produced messages alive so their id()s stay unique until confirmed
+    pending = {}
+
+    for index, item in enumerate(body):
+        error = next(validator.iter_errors(item), None)
+        if error is not None:
+            results.append({"index": index, "status": 400, "message": error.message})
+            continue
+
+        trace_id = str(uuid.uuid4())
+        event_data = {field: item[field] for field in fields if field in item}
+        event_data["trace_id"] = trace_id
+
+        try:
+            message = send_event_to_kafka(event_type, event_data, batch_producer)
+        except ProducerQueueFullError:
+            logger.warning("Kafka producer queue full, rejecting event", extra={"trace_id": trace_id})
+            results.append({"index": index, "status": 503, "message": "Event queue is full, retry later"})
+            continue
+
+        if batch_producer is not None:
+            sent.append(message)
+            pending[id(message)] = len(results)
+        results.append({"index": index, "status": 201, "trace_id": trace_id})
+        accepted += 1
+
+    # In sync mode the whole batch was enqueued above and goes out together; wait for its acknowledgements once
+    if pending:
+        accepted -= confirm_deliveries(pending, results)
+
+    logger.info(f"Received {event_type} batch; {accepted} of {len(body)} events accepted")
+    return {"accepted": accepted, "rejected": len(body) - accepted, "results": results}, 207
+
+# Function for receiving a batch of player events
+def receive_player_event_batch(body):
+    return receive_event_batch("player_event", body)
+
+# Function for receiving a batch of server events
+def receive_server_event_batch(body):
+    return receive_event_batch("server_event", body)
+
 # Create the connexion app
 app = connexion.FlaskApp(__name__, specification_dir='')
+app.add_middleware(MetricsMiddleware, position=MiddlewarePosition.BEFORE_EXCEPTION)
 
 # Add the API specification (make sure your openapi.yml file is in place)
-app.add_api("ACIT3855-ProjectReceiver.yaml", strict_validation=True, validate_responses=True)
+app.add_api("ACIT3855-ProjectReceiver.yaml", strict_validation=True, validate_responses=True,
+            validator_map=VALIDATOR_MAP)
 
 # Run the app
 if __name__ == "__main__":
@@ -0,0 +1,35 @@
+import json
+from connexion.datastructures import MediaTypeDict
+from connexion.validators import (
+    AbstractRequestBodyValidator,
+    FormDataValidator,
+    JSONRequestBodyValidator,
+    MultiPartFormDataValidator,
+)
+
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+def parse_ndjson(body):
+    """Decode a newline-delimited JSON body into a list, skipping blank lines"""
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+class NDJSONRequestBodyValidator(AbstractRequestBodyValidator):
+    """Passes NDJSON bodies through untouched; the batch handlers validate each line"""
+
+    async def _parse(self, stream, scope):
+        async for _ in stream:
+            pass  # Drain the body so the original messages are replayed to the handler
+        return None
+
+# Validators passed to add_api so NDJSON isn't parsed as a single JSON document by */*json
+VALIDATOR_MAP = {
+    "body": MediaTypeDict({
+        "*/*json": JSONRequestBodyValidator,
+        "application/x-www-form-urlencoded": FormDataValidator,
+        "multipart/form-data": MultiPartFormDataValidator,
+        NDJSON_MIMETYPE: NDJSONRequestBodyValidator,
+    })
+}
@@ -1,27 +1,38 @@
 import connexion
 from connexion import NoContent
 from models import PlayerEvent, ServerEvent, make_session
-from models import Base, engine
+from models import Base, configure_engine, ensure_indexes
 from dateutil import parser
 import yaml
 import json
-from sqlalchemy import create_engine
+import base64
 import sqlalchemy
+from sqlalchemy import delete, select, func, and_, or_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 import logging
-import logging.config
-from datetime import datetime
+import time
+from datetime import datetime, timedelta, timezone
 from pykafka import KafkaClient
 from pykafka.common import OffsetType
-from threading import Thread
+from apscheduler.schedulers.background import BackgroundScheduler
+from threading import Thread, Lock
+from flask import Response, jsonify, request, stream_with_context
+from connexion.middleware import MiddlewarePosition
+from prometheus_client import Counter, Gauge, Histogram
+from dedup import make_deduplicator
+from archive import EventArchive, floor_time, schema_for
+from response_cache import ResponseCache
+from rollups import RollupConflict, query_rollups, unstored_rows, upsert_rollups
+from event_common.metrics import MetricsMiddleware
+from event_common.log_setup import setup_logging
+from event_common.codec import decode
+from ndjson import NDJSON_MIMETYPE, NDJSONResponseBodyValidator, VALIDATOR_MAP, encode_records, encode_rows
 
 
 SERVICE_NAME = "storage"
 
-# Load logging configuration from YAML
-with open("config/log_conf.yml", "r") as log_file:
-    log_config = yaml.safe_load(log_file)
-    log_config['handlers']['file']['filename'] = f'logs/{SERVICE_NAME}.log'
-    logging.config.dictConfig(log_config)
+# Load logging configuration from YAML; handlers write from a background thread
+setup_logging("config/log_conf.yml", f'logs/{SERVICE_NAME}.log')
 
 logger = logging.getLogger('basicLogger')
 
@@ -33,129 +44,585 @@ with open('config/storage_conf.yml', 'r') as f:
 db_config = app_config['datastore']
 db_url = f"mysql://{db_config['user']}:{db_config['password']}@{db_config['hostname']}:{db_config['port']}/{db_config['db']}?charset=utf8mb4"
 
-# Create engine using the loaded config
-engine = create_engine(db_url)
+# Create engine using the loaded config, with one pooled connection per consumer worker plus headroom for the API
+engine = configure_engine(
+    db_url,
+    pool_size=db_config['pool_size'],
+    max_overflow=db_config['max_overflow'],
+    pool_recycle=db_config['pool_recycle'],
+    pool_pre_ping=True,
+    # Report affected rather than found rows, so ON DUPLICATE KEY UPDATE counts only the rows it inserted
+    connect_args={"client_flag": 0}
+)
 
 # Ensure that all tables are created before starting the application
 Base.metadata.create_all(engine)
+# Tables from older versions lack the range, per-server and unique trace_id indexes; building one can take a while
+for index_name in ensure_indexes(engine):
+    logger.info(f"Created missing index {index_name}")
 
 # Extract Kafka connection details
 kafka_config = app_config['events']['kafka']
 KAFKA_HOST = f"{kafka_config['hostname']}:{kafka_config['port']}"
 TOPIC_NAME = kafka_config['topic']
 
-def process_messages():
-    """Consume Kafka messages and store them in the database"""
+# Extract streaming settings for the event range endpoints
+api_config = app_config['api']
+STREAM_CHUNK_SIZE = api_config['stream_chunk_size']
+NDJSONResponseBodyValidator.sample_every = api_config['ndjson_validation_sample']
+
+# Serialised responses for windows that have closed, and so can no longer change
+cache_config = api_config['cache']
+response_cache = ResponseCache(cache_config['max_bytes'], cache_config['max_entry_bytes'], cache_config['ttl'])
+CACHE_SETTLE = cache_config['settle_seconds']
+
+# Extract batching settings for the consumer
+consumer_config = app_config['events']['consumer']
+BATCH_SIZE = consumer_config['batch_size']
+BATCH_TIMEOUT_MS = consumer_config['batch_timeout_ms']
+RETRY_INTERVAL = consumer_config['retry_interval']
+LAG_INTERVAL = consumer_config['lag_interval']
+CONSUMER_GROUP = consumer_config['group']
+WORKERS = consumer_config['workers']
+
+# Recently stored trace_ids, so redelivered messages are dropped before reaching MySQL
+dedup_config = app_config['events']['dedup']
+deduplicator = make_deduplicator(dedup_config['strategy'], dedup_config['size'])
+
+# Closed windows older than the hot retention move from MySQL to Parquet segments
+archive_config = app_config['archive']
+archive = EventArchive(archive_config['directory'], archive_config['compression'])
+SEGMENT_SECONDS = archive_config['segment_seconds']
+HOT_RETENTION = archive_config['hot_retention_seconds']
+PURGE_BATCH_SIZE = archive_config['purge_batch_size']
+PURGE_GRACE = archive_config['purge_grace_seconds']
+ARCHIVE_SCHEMAS = {model: schema_for(model) for model in (PlayerEvent, ServerEvent)}
+
+# Hot-path metrics served at /metrics
+MESSAGES_CONSUMED = Counter("kafka_messages_consumed_total", "Messages read from the events topic")
+BATCH_MESSAGES = Histogram("ingest_batch_messages", "Messages per ingest batch",
+                           buckets=(1, 10, 50, 100, 250, 500, 1000, 2500))
+DB_COMMIT_LATENCY = Histogram("db_commit_duration_seconds", "Time to insert and commit one batch", ["mode"])
+EVENTS_STORED = Counter("events_stored_total", "Rows inserted", ["table"])
+DUPLICATES_SKIPPED = Counter("duplicate_events_skipped_total", "Redelivered events not stored again", ["source"])
+EVENTS_ARCHIVED = Counter("events_archived_total", "Rows written to archive segments", ["table"])
+EVENTS_PURGED = Counter("events_purged_total", "Archived rows deleted from MySQL", ["table"])
+# Set by each worker from its consumer loop, so scrapes never wait on the brokers
+CONSUMER_LAG = Gauge("kafka_consumer_lag", "Messages between the committed position and the log end", ["partition"])
+CACHE_LOOKUPS = Counter("response_cache_lookups_total", "Range queries by cache outcome", ["table", "result"])
+Gauge("response_cache_bytes", "Size of the cached response bodies").set_function(response_cache.size_bytes)
+Gauge("response_cache_entries", "Responses held in the cache").set_function(lambda: len(response_cache))
+
+def insert_skipping_duplicates(model):
+    """INSERT ... ON DUPLICATE KEY UPDATE id = id: rows whose trace_id is already stored are left untouched.
+
+    Unlike INSERT IGNORE, truncation and other data errors still fail the
+    statement instead of being stored as warnings.
+    """
+    return mysql_insert(model).on_duplicate_key_update(id=model.id)
+
+def build_row(msg_json):
+    """Map a decoded Kafka message to its model and a row of column values"""
+    payload = msg_json["payload"]
+
+    if msg_json["type"] == "player_event":
+        return PlayerEvent, {
+            "player_id": payload['player_id'],
+            "server_id": payload['server_id'],
+            "action": payload['action'],
+            "score": payload['score'],
+            "timestamp": parser.isoparse(payload['timestamp']),
+            "trace_id": payload['trace_id']
+        }
+
+    if msg_json["type"] == "server_event":
+        return ServerEvent, {
+            "server_id": payload['server_id'],
+            "uptime": payload['uptime'],
+            "cpu_usage": payload['cpu_usage'],
+            "memory_usage": payload['memory_usage'],
+            "timestamp": parser.isoparse(payload['timestamp']),
+            "trace_id": payload['trace_id']
+        }
+
+    raise ValueError(f"Unknown event type: {msg_json['type']}")
+
+def store_rows_individually(rows_by_model):
+    """Insert rows one transaction at a time so a bad row only loses itself"""
+    session = make_session()
+    stored = 0
+
+    try:
+        for model, rows in rows_by_model.items():
+            for row in rows:
+                try:
+                    start = time.perf_counter()
+                    result = session.execute(insert_skipping_duplicates(model), [row])
+                    if result.rowcount:
+                        upsert_rollups(session, model, [row])
+                    session.commit()
+                    DB_COMMIT_LATENCY.labels("row").observe(time.perf_counter() - start)
+                    EVENTS_STORED.labels(model.__tablename__).inc(result.rowcount)
+                    stored += result.rowcount
+                    deduplicator.remember([row])
+                except sqlalchemy.exc.IntegrityError as e:
+                    logger.error("Integrity error storing event: %s", e, extra={"trace_id": row['trace_id']})
+                    session.rollback()
+                except sqlalchemy.exc.OperationalError:
+                    session.rollback()
+                    raise  # Database unavailable, not a problem with this row
+                except sqlalchemy.exc.SQLAlchemyError as e:
+                    logger.error("Rejected %s row: %s", model.__tablename__, e, extra={"trace_id": row['trace_id']})
+                    session.rollback()
+    finally:
+        session.close()
+
+    return stored
+
+def store_batch(messages):
+    """Write a batch of Kafka messages with one multi-row insert per table"""
+    rows_by_model = {PlayerEvent: [], ServerEvent: []}
+
+    for msg in messages:
+        try:
+            msg_json = decode(msg.value)
+            model, row = build_row(msg_json)
+            rows_by_model[model].append(row)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error("Skipping malformed message at offset %s: %s", msg.offset, e)
+
+    cached_duplicates = 0
+    for model in rows_by_model:
+        rows_by_model[model], dropped = deduplicator.filter(rows_by_model[model])
+        cached_duplicates += dropped
+
+    session = make_session()
+
+    try:
+        stored_by_model = {}
+        start = time.perf_counter()
+        for model, rows in rows_by_model.items():
+            if rows:
+                new_rows = unstored_rows(session, model, rows)
+                stored_by_model[model] = session.execute(insert_skipping_duplicates(model), rows).rowcount
+                if stored_by_model[model] != len(new_rows):
+                    raise RollupConflict(f"{len(new_rows)} new {model.__tablename__} rows but {stored_by_model[model]} inserted")
+                upsert_rollups(session, model, new_rows)
+        session.commit()
+        DB_COMMIT_LATENCY.labels("bulk").observe(time.perf_counter() - start)
+        for model, count in stored_by_model.items():
+            EVENTS_STORED.labels(model.__tablename__).inc(count)
+        stored = sum(stored_by_model.values())
+        for rows in rows_by_model.values():
+            deduplicator.remember(rows)  # Only once committed, or a retried batch would be skipped
+    except sqlalchemy.exc.OperationalError:
+        session.rollback()
+        raise  # Database unavailable, let the caller retry the whole batch
+    except (sqlalchemy.exc.SQLAlchemyError, RollupConflict) as e:
+        session.rollback()
+        logger.warning(f"Bulk insert failed, retrying batch row by row: {e}")
+        stored = store_rows_individually(rows_by_model)
+    finally:
+        session.close()
+
+    received = sum(len(rows) for rows in rows_by_model.values())
+    DUPLICATES_SKIPPED.labels("cache").inc(cached_duplicates)
+    DUPLICATES_SKIPPED.labels("database").inc(max(received - stored, 0))
+    logger.info("Stored %s events (%s player, %s server), skipped %s recent duplicates and %s already stored",
+                stored, len(rows_by_model[PlayerEvent]), len(rows_by_model[ServerEvent]),
+                cached_duplicates, received - stored)
+
+def consume_batch(consumer):
+    """Collect up to BATCH_SIZE messages or whatever arrives within BATCH_TIMEOUT_MS"""
+    batch = []
+    deadline = time.monotonic() + BATCH_TIMEOUT_MS / 1000
+
+    while len(batch) < BATCH_SIZE and time.monotonic() < deadline:
+        msg = consumer.consume()  # Returns None once consumer_timeout_ms elapses
+        if msg is None:
+            break
+        batch.append(msg)
+
+    MESSAGES_CONSUMED.inc(len(batch))
+    return batch
+
+# Consumer workers by id, for the lag endpoint
+workers = {}
+workers_lock = Lock()
+
+def make_consumer():
+    """Join the consumer group; Kafka assigns this worker a share of the topic's partitions"""
     client = KafkaClient(hosts=KAFKA_HOST)
     topic = client.topics[str.encode(TOPIC_NAME)]
-    
-    consumer = topic.get_simple_consumer(
-        consumer_group=b'event_group',
+    consumer = topic.get_balanced_consumer(
+        consumer_group=CONSUMER_GROUP.encode(),
+        managed=True,  # Group membership through Kafka rather than ZooKeeper
+        auto_commit_enable=False,
         reset_offset_on_start=False,
-        auto_offset_reset=OffsetType.LATEST
+        auto_offset_reset=OffsetType.LATEST,
+        consumer_timeout_ms=BATCH_TIMEOUT_MS
     )
+    return topic, consumer
+
+def process_messages(worker_id):
+    """Consume this worker's partitions and store them in the database in batches"""
+    while True:
+        try:
+            topic, consumer = make_consumer()
+        except Exception as e:
+            logger.error(f"Worker {worker_id} could not join consumer group {CONSUMER_GROUP}: {e}")
+            time.sleep(RETRY_INTERVAL)
+            continue
+
+        with workers_lock:
+            workers[worker_id] = {"topic": topic, "consumer": consumer}
+
+        logger.info(f"Kafka consumer worker {worker_id} started... Listening for messages "
+                    f"(batch_size={BATCH_SIZE}, batch_timeout_ms={BATCH_TIMEOUT_MS}).")
+
+        try:
+            consume_loop(topic, consumer)
+        except Exception as e:
+            logger.error(f"Worker {worker_id} lost its consumer, rejoining in {RETRY_INTERVAL}s: {e}")
+            try:
+                consumer.stop()
+            except Exception:
+                pass
+            time.sleep(RETRY_INTERVAL)
+
+def update_lag_gauge(topic, consumer, reported):
+    """Set kafka_consumer_lag for the partitions this worker holds and drop the ones it gave up in a rebalance"""
+    latest = {p: r.offset[0] for p, r in topic.latest_available_offsets().items()}
+    held = {p: o for p, o in (consumer.held_offsets or {}).items() if o >= 0}  # -1 means nothing consumed yet
+    for partition_id, offset in held.items():
+        CONSUMER_LAG.labels(str(partition_id)).set(latest.get(partition_id, 0) - (offset + 1))
+    for partition_id in reported - held.keys():
+        try:
+            CONSUMER_LAG.remove(str(partition_id))
+        except KeyError:
+            pass
+    return set(held)
+
+def consume_loop(topic, consumer):
+    # A partition belongs to one worker at a time, so messages within it are stored and committed in order
+    reported = set()
+    last_lag_update = 0.0
+
+    while True:
+        if time.monotonic() - last_lag_update >= LAG_INTERVAL:
+            try:
+                reported = update_lag_gauge(topic, consumer, reported)
+            except Exception as e:
+                logger.error(f"Could not refresh consumer lag: {e}")
+            last_lag_update = time.monotonic()
 
-    logger.info("Kafka Consumer started... Listening for messages.")
-
-    for msg in consumer:
-        if msg is not None:
-            msg_str = msg.value.decode('utf-8')
-            msg_json = json.loads(msg_str)
-
-            logger.info(f"Received message: {msg_json}")
-            payload = msg_json["payload"]
-
-            session = make_session()
+        batch = consume_batch(consumer)
+        if not batch:
+            continue
+        BATCH_MESSAGES.observe(len(batch))
 
+        while True:
             try:
-                if msg_json["type"] == "player_event":
-                    event = PlayerEvent(
-                        player_id=payload['player_id'],
-                        server_id=payload['server_id'],
-                        action=payload['action'],
-                        score=payload['score'],
-                        timestamp=parser.isoparse(payload['timestamp']),
-                        trace_id=payload['trace_id']
-                    )
-                    session.add(event)
-                    logger.info(f"Stored Player event: {payload}")
-
-                elif msg_json["type"] == "server_event":
-                    event = ServerEvent(
-                        server_id=payload['server_id'],
-                        uptime=payload['uptime'],
-                        cpu_usage=payload['cpu_usage'],
-                        memory_usage=payload['memory_usage'],
-                        timestamp=parser.isoparse(payload['timestamp']),
-                        trace_id=payload['trace_id']
-                    )
-                    session.add(event)
-                    logger.info(f"Stored Server event: {payload}")
-
-                session.commit()
-                consumer.commit_offsets()  # Ensure offset is committed only after successful processing
-                
-            except sqlalchemy.exc.IntegrityError as e:
-                logger.error(f"Duplicate entry detected: {e}")
-                session.rollback()  # Rollback the transaction if a duplicate is detected
-
-            finally:
-                session.close()
-
-
-def setup_kafka_thread():
-    consumer_thread = Thread(target=process_messages)
-    consumer_thread.daemon = True
-    consumer_thread.start()
+                store_batch(batch)
+                break
+            except sqlalchemy.exc.OperationalError as e:
+                logger.error(f"Database unavailable, retrying batch of {len(batch)} in {RETRY_INTERVAL}s: {e}")
+                time.sleep(RETRY_INTERVAL)
+
+        consumer.commit_offsets()  # Commit once per batch, only after it has been stored
+
+def setup_kafka_threads():
+    for worker_id in range(WORKERS):
+        consumer_thread = Thread(target=process_messages, args=(worker_id,))
+        consumer_thread.daemon = True
+        consumer_thread.start()
+
+def get_consumer_lag():
+    """Report each worker's partitions, positions and how far behind the log end they are"""
+    with workers_lock:
+        current = dict(workers)
+
+    report = {"group": CONSUMER_GROUP, "workers": WORKERS, "total_lag": 0, "partitions": []}
+    latest = None
+    for worker_id, worker in sorted(current.items()):
+        try:
+            if latest is None:
+                latest = {p: r.offset[0] for p, r in worker["topic"].latest_available_offsets().items()}
+            held = worker["consumer"].held_offsets or {}
+        except Exception as e:
+            logger.error(f"Could not read offsets for worker {worker_id}: {e}")
+            continue
+
+        for partition_id, offset in sorted(held.items()):
+            next_offset = offset + 1 if offset >= 0 else None  # Nothing consumed yet
+            lag = latest.get(partition_id, 0) - next_offset if next_offset is not None else None
+            report["partitions"].append({
+                "worker": worker_id,
+                "partition": partition_id,
+                "next_offset": next_offset,
+                "log_end_offset": latest.get(partition_id),
+                "lag": lag
+            })
+            report["total_lag"] += lag or 0
+
+    return report, 200
+
+def archive_closed_segments():
+    """Move closed date_created windows older than the hot retention from MySQL into archive segments"""
+    cutoff = floor_time(datetime.utcnow() - timedelta(seconds=HOT_RETENTION), SEGMENT_SECONDS)
+
+    for model in (PlayerEvent, ServerEvent):
+        table = model.__tablename__
+        session = make_session()
+        try:
+            while True:
+                # Jump straight to the next window holding rows rather than writing empty segments
+                archived_until = archive.archived_until(table)
+                oldest = select(func.min(model.date_created)).where(model.date_created < cutoff)
+                if archived_until is not None:
+                    oldest = oldest.where(model.date_created >= archived_until)
+                first = session.execute(oldest).scalar()
+                if first is None:
+                    break
+
+                start = floor_time(first, SEGMENT_SECONDS)
+                end = start + timedelta(seconds=SEGMENT_SECONDS)
+                result = session.execute(hot_events_query(model, start, end).execution_options(yield_per=STREAM_CHUNK_SIZE))
+                chunks = ([row._asdict() for row in rows] for rows in result.partitions())
+                segment = archive.write_segment(table, ARCHIVE_SCHEMAS[model], start, end, chunks)
+                session.commit()  # Ends the read transaction so the next window sees current data
+
+                EVENTS_ARCHIVED.labels(table).inc(segment["rows"])
+                logger.info(f"Archived {segment['rows']} {table} rows from {start.isoformat()} to {end.isoformat()}")
+        except Exception as e:
+            logger.error(f"Archiving {table} failed, retrying next run: {e}")
+            session.rollback()
+        finally:
+            session.close()
+
+        purge_archived(model)
+
+def purge_archived(model):
+    """Delete rows the archive has served for PURGE_GRACE, in small batches so inserts aren't blocked for long"""
+    archived_until = archive.purgeable_until(model.__tablename__, PURGE_GRACE)
+    if archived_until is None:
+        return
 
-# Define a function to fetch player events within a date range
-def get_player_events(start_timestamp, end_timestamp):
     session = make_session()
-    start_time = parser.isoparse(start_timestamp)
-    end_time = parser.isoparse(end_timestamp)
+    try:
+        while True:
+            stmt = delete(model).where(model.date_created < archived_until).with_dialect_options(
+                mysql_limit=PURGE_BATCH_SIZE)
+            deleted = session.execute(stmt).rowcount
+            session.commit()
+            EVENTS_PURGED.labels(model.__tablename__).inc(deleted)
+            if deleted < PURGE_BATCH_SIZE:
+                break
+    except sqlalchemy.exc.SQLAlchemyError as e:
+        logger.error(f"Purging archived {model.__tablename__} rows failed, retrying next run: {e}")
+        session.rollback()
+    finally:
+        session.close()
+
+def init_scheduler():
+    sched = BackgroundScheduler(daemon=True)
+    # Runs never overlap, so a window is archived and purged by one run at a time
+    sched.add_job(archive_closed_segments, 'interval', seconds=archive_config['interval'],
+                  max_instances=1, coalesce=True)
+    sched.start()
+
+def encode_cursor(date_created, event_id):
+    """Build an opaque pagination cursor from the last (date_created, id) returned"""
+    raw = json.dumps([date_created.isoformat(), event_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    """Parse a cursor produced by encode_cursor back into (date_created, id)"""
+    date_created, event_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return parser.isoparse(date_created), int(event_id)
+
+def hot_events_query(model, start_time, end_time, after=None):
+    """MySQL range query on (date_created, id), after the keyset cursor if one is given"""
+    # Select columns rather than ORM instances so rows aren't hydrated into the session
+    stmt = select(*model.__table__.columns).where(
+        model.date_created >= start_time,
+        model.date_created < end_time
+    )
 
-    # Query the PlayerEvent table
-    events = session.query(PlayerEvent).filter(
-        PlayerEvent.date_created >= start_time,
-        PlayerEvent.date_created < end_time
-    ).all()
+    if after is not None:
+        after_date, after_id = after
+        stmt = stmt.where(or_(
+            model.date_created > after_date,
+            and_(model.date_created == after_date, model.id > after_id)
+        ))
+
+    return stmt.order_by(model.date_created, model.id)
+
+def stream_events(model, start_time, end_time, after, limit):
+    """Yield NDJSON chunks from the archive up to the boundary, then from a MySQL server-side cursor"""
+    table = model.__tablename__
+    remaining = limit
+
+    # Windows archived while earlier segments were read are read from the archive too, so the MySQL
+    # query starts right after a fresh look at the boundary, well inside the purge grace period
+    boundary = archive.archived_until(table)
+    scanned = start_time
+    while boundary is not None and scanned < min(end_time, boundary) and remaining != 0:
+        for rows in archive.scan(table, scanned, min(end_time, boundary), after, remaining):
+            for batch in rows.to_batches(max_chunksize=STREAM_CHUNK_SIZE):
+                yield encode_records(batch.to_pylist())
+            if remaining is not None:
+                remaining -= len(rows)
+        scanned = min(end_time, boundary)
+        boundary = archive.archived_until(table)
+
+    hot_start = max(start_time, boundary) if boundary is not None else start_time
+    if hot_start >= end_time or remaining == 0:
+        return
+
+    stmt = hot_events_query(model, hot_start, end_time, after)
+    if remaining is not None:
+        stmt = stmt.limit(remaining)
 
-    # Convert the events to dictionaries
-    event_list = [event.__dict__ for event in events]
-    for event in event_list:
-        event.pop('_sa_instance_state', None)  # Remove SQLAlchemy internal state
+    session = make_session()
+    try:
+        result = session.execute(stmt.execution_options(yield_per=STREAM_CHUNK_SIZE))
+        for rows in result.partitions():
+            yield encode_rows(rows)
+    finally:
+        session.close()
+
+def as_utc(moment):
+    """Naive UTC datetime, so equal instants given with different offsets compare and hash alike"""
+    if moment.tzinfo is not None:
+        return moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+def query_events(model, start_timestamp, end_timestamp, limit=None, cursor=None):
+    """Range query on (date_created, id), served from the response cache once the window has closed"""
+    # date_created and the archive boundary are naive UTC, so offsets like Z are converted before any comparison
+    start_time = as_utc(parser.isoparse(start_timestamp))
+    end_time = as_utc(parser.isoparse(end_timestamp))
+
+    after = None
+    if cursor is not None:
+        try:
+            after_date, after_id = decode_cursor(cursor)
+            after = (as_utc(after_date), after_id)
+        except (ValueError, TypeError) as e:
+            logger.error(f"Invalid cursor {cursor}: {e}")
+            return {"message": "Invalid cursor"}, 400
+
+    table = model.__tablename__
+
+    if NDJSON_MIMETYPE in request.headers.get("Accept", ""):
+        CACHE_LOOKUPS.labels(table, "bypass").inc()
+        # Streamed responses are not paginated, limit just caps them
+        return Response(stream_with_context(stream_events(model, start_time, end_time, after, limit)),
+                        mimetype=NDJSON_MIMETYPE)
+
+    # In-flight inserts are stamped with their transaction's start, so a window only closes CACHE_SETTLE later
+    if end_time > datetime.utcnow() - timedelta(seconds=CACHE_SETTLE):
+        CACHE_LOOKUPS.labels(table, "bypass").inc()
+        event_list, headers = fetch_events(model, start_time, end_time, after, limit)
+        return event_list, 200, headers
+
+    key = (table, start_time, end_time, limit, after)
+    cached = response_cache.get(key)
+    if cached is not None:
+        CACHE_LOOKUPS.labels(table, "hit").inc()
+        return Response(cached.body, status=200, headers=cached.headers, mimetype="application/json")
+
+    CACHE_LOOKUPS.labels(table, "miss").inc()
+    event_list, headers = fetch_events(model, start_time, end_time, after, limit)
+    response = jsonify(event_list)
+    response.headers.update(headers)
+    response_cache.put(key, response.get_data(), headers)
+    return response
+
+def fetch_events(model, start_time, end_time, after, limit):
+    """Keyset-paginated rows as plain dicts, plus the X-Next-Cursor header when another page exists.
+
+    Windows before the archive boundary are read from Parquet segments and
+    the rest from MySQL; both are ordered on (date_created, id), so a cursor
+    carries across the boundary unchanged. The boundary is read again after
+    each archive pass, as in stream_events, so rows purged meanwhile are
+    still found in their new segment.
+    """
+    table = model.__tablename__
+    fetch = limit + 1 if limit is not None else None  # One extra row tells us whether another page exists
+    event_list = []
+
+    boundary = archive.archived_until(table)
+    scanned = start_time
+    while boundary is not None and scanned < min(end_time, boundary) and (fetch is None or len(event_list) < fetch):
+        for rows in archive.scan(table, scanned, min(end_time, boundary), after,
+                                 fetch - len(event_list) if fetch is not None else None):
+            event_list.extend(rows.to_pylist())
+        scanned = min(end_time, boundary)
+        boundary = archive.archived_until(table)
+
+    hot_start = max(start_time, boundary) if boundary is not None else start_time
+    if hot_start < end_time and (fetch is None or len(event_list) < fetch):
+        stmt = hot_events_query(model, hot_start, end_time, after)
+        if fetch is not None:
+            stmt = stmt.limit(fetch - len(event_list))
+
+        session = make_session()
+        try:
+            event_list.extend(row._asdict() for row in session.execute(stmt))
+        finally:
+            session.close()
+
+    headers = {}
+    if limit is not None and len(event_list) > limit:
+        event_list = event_list[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(event_list[-1]["date_created"], event_list[-1]["id"])
+    if event_list:
+        headers["X-Last-Cursor"] = encode_cursor(event_list[-1]["date_created"], event_list[-1]["id"])
+
+    return event_list, headers
 
-    session.close()
-    return event_list
+# Define a function to fetch player events within a date range
+def get_player_events(start_timestamp, end_timestamp, limit=None, cursor=None):
+    return query_events(PlayerEvent, start_timestamp, end_timestamp, limit, cursor)
 
 # Define a function to fetch server events within a date range
-def get_server_events(start_timestamp, end_timestamp):
-    session = make_session()
-    start_time = parser.isoparse(start_timestamp)
-    end_time = parser.isoparse(end_timestamp)
+def get_server_events(start_timestamp, end_timestamp, limit=None, cursor=None):
+    return query_events(ServerEvent, start_timestamp, end_timestamp, limit, cursor)
+
+ROLLUP_MODELS = {"player": PlayerEvent, "server": ServerEvent}
 
-    # Query the ServerEvent table
-    events = session.query(ServerEvent).filter(
-        ServerEvent.date_created >= start_time,
-        ServerEvent.date_created < end_time
-    ).all()
+def get_event_rollup(event_type, start, end, granularity="1m", group_by=None):
+    """Counts and score/cpu/memory summaries per time bucket, read from the per-minute rollup tables"""
+    model = ROLLUP_MODELS[event_type]
+    if group_by == "action" and model is not PlayerEvent:
+        return {"message": "Server events can only be grouped by server_id"}, 400
 
-    # Convert the events to dictionaries
-    event_list = [event.__dict__ for event in events]
-    for event in event_list:
-        event.pop('_sa_instance_state', None)  # Remove SQLAlchemy internal state
+    start_time = as_utc(parser.isoparse(start))
+    end_time = as_utc(parser.isoparse(end))
+    if start_time >= end_time:
+        return {"message": "start must be before end"}, 400
+
+    session = make_session()
+    try:
+        buckets = query_rollups(session, model, granularity, start_time, end_time, group_by)
+    finally:
+        session.close()
 
-    session.close()
-    return event_list
+    return {"granularity": granularity, "buckets": buckets}, 200
 
 # Create the connexion app
 app = connexion.FlaskApp(__name__, specification_dir='')
+app.add_middleware(MetricsMiddleware, position=MiddlewarePosition.BEFORE_EXCEPTION)
 
 # Add the API specification
-app.add_api("ACIT3855-ProjectStorage.yaml", strict_validation=True, validate_responses=True)
+app.add_api("ACIT3855-ProjectStorage.yaml", strict_validation=True, validate_responses=True,
+            validator_map=VALIDATOR_MAP)
 
 # Run the app
 if __name__ == "__main__":
-    setup_kafka_thread()
+    setup_kafka_threads()
+    init_scheduler()
     app.run(port=8090, host="0.0.0.0")
 
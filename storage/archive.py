@@ -0,0 +1,147 @@
+import json
+import os
+from datetime import datetime, timedelta
+from threading import Lock
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sqlalchemy import DateTime, Float, Integer, String
+
+
+ARROW_TYPES = {Integer: pa.int64(), String: pa.string(), Float: pa.float64(), DateTime: pa.timestamp("us")}
+
+def schema_for(model):
+    """Arrow schema matching a model's columns"""
+    return pa.schema([(column.name, ARROW_TYPES[type(column.type)]) for column in model.__table__.columns])
+
+def floor_time(moment, seconds):
+    """Start of the segment-sized window containing moment"""
+    epoch = datetime(1970, 1, 1)
+    return epoch + timedelta(seconds=(moment - epoch) // timedelta(seconds=seconds) * seconds)
+
+class EventArchive:
+    """Closed date_created windows of each table as zstd-compressed Parquet segments.
+
+    A JSON manifest records every segment's window and min/max date_created
+    and id. Range scans skip segments the manifest rules out and read the
+    rest memory-mapped. Everything before archived_until(table) is served from
+    here, so a window's rows can leave MySQL once its segment is listed and
+    queries that read the previous boundary have had time to finish.
+    """
+
+    def __init__(self, directory, compression="zstd"):
+        self.directory = directory
+        self.compression = compression
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self._lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+        if not os.access(directory, os.W_OK | os.X_OK):
+            # Fail at startup rather than on the first archive run, which would only log and retry forever
+            raise PermissionError(f"Archive directory {directory} is not writable by uid {os.getuid()}")
+
+        self.segments = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                for table, segments in json.load(f).items():
+                    self.segments[table] = [self._parse(segment) for segment in segments]
+
+    @staticmethod
+    def _parse(segment):
+        return {**segment, **{key: datetime.fromisoformat(segment[key])
+                              for key in ("start", "end", "min_date_created", "max_date_created", "archived_at")
+                              if segment.get(key) is not None}}
+
+    def _save_manifest(self):
+        manifest = {
+            table: [{key: value.isoformat() if isinstance(value, datetime) else value for key, value in segment.items()}
+                    for segment in segments]
+            for table, segments in self.segments.items()
+        }
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def archived_until(self, table):
+        """End of the last archived window, or None if nothing is archived yet"""
+        with self._lock:
+            segments = self.segments.get(table)
+            return segments[-1]["end"] if segments else None
+
+    def purgeable_until(self, table, grace):
+        """End of the last window archived at least `grace` seconds ago, or None.
+
+        Purging waits out the grace period so a query that read the boundary
+        just before a segment was listed still finds that window's rows in
+        MySQL. Segments from manifests without archived_at count as old.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=grace)
+        with self._lock:
+            settled = [segment["end"] for segment in self.segments.get(table, [])
+                       if segment.get("archived_at") is None or segment["archived_at"] <= cutoff]
+            return settled[-1] if settled else None
+
+    def write_segment(self, table, schema, start, end, chunks):
+        """Write the rows of [start, end), given as chunks of dicts in (date_created, id) order, as one segment.
+
+        The manifest only lists the segment once the file is complete, so a
+        crash part way through leaves the window to be archived again.
+        """
+        filename = f"{start:%Y%m%dT%H%M%S}.parquet"
+        path = os.path.join(self.directory, table, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        rows = 0
+        bounds = {}
+        with pq.ParquetWriter(f"{path}.tmp", schema, compression=self.compression) as writer:
+            for chunk in chunks:
+                batch = pa.Table.from_pylist(chunk, schema=schema)
+                writer.write_table(batch)  # One row group per chunk, each with its own statistics
+                rows += len(chunk)
+                for column in ("date_created", "id"):
+                    low, high = pc.min_max(batch[column]).values()
+                    previous = bounds.get(column, (low.as_py(), high.as_py()))
+                    bounds[column] = (min(previous[0], low.as_py()), max(previous[1], high.as_py()))
+        os.replace(f"{path}.tmp", path)
+
+        segment = {"file": os.path.join(table, filename), "start": start, "end": end, "rows": rows,
+                   "min_date_created": bounds.get("date_created", (start, start))[0],
+                   "max_date_created": bounds.get("date_created", (start, start))[1],
+                   "min_id": bounds.get("id", (None, None))[0], "max_id": bounds.get("id", (None, None))[1],
+                   "archived_at": datetime.utcnow()}
+        with self._lock:
+            self.segments.setdefault(table, []).append(segment)
+            self._save_manifest()
+        return segment
+
+    def scan(self, table, start, end, after=None, limit=None):
+        """Rows with start <= date_created < end, after the (date_created, id) cursor, in (date_created, id) order.
+
+        Yields one Arrow table per segment that can hold matching rows;
+        segments are disjoint windows, so stopping after `limit` rows never
+        skips an earlier row.
+        """
+        with self._lock:
+            segments = list(self.segments.get(table, []))
+
+        remaining = limit
+        for segment in segments:
+            if segment["rows"] == 0 or segment["max_date_created"] < start or segment["min_date_created"] >= end:
+                continue
+            if after is not None and segment["max_date_created"] < after[0]:
+                continue
+
+            filters = [("date_created", ">=", max(start, after[0] if after else start)), ("date_created", "<", end)]
+            rows = pq.read_table(os.path.join(self.directory, segment["file"]), memory_map=True, filters=filters)
+            if after is not None:
+                rows = rows.filter(pc.or_(pc.greater(rows["date_created"], pa.scalar(after[0], pa.timestamp("us"))),
+                                          pc.greater(rows["id"], after[1])))
+            rows = rows.sort_by([("date_created", "ascending"), ("id", "ascending")])
+
+            if remaining is not None:
+                rows = rows.slice(0, remaining)
+                remaining -= len(rows)
+            if len(rows):
+                yield rows
+            if remaining == 0:
+                return
@@ -0,0 +1,49 @@
+import threading
+from collections import OrderedDict
+
+
+class NoDeduplicator:
+    """Leaves deduplication entirely to the unique trace_id index"""
+
+    def filter(self, rows):
+        return rows, 0
+
+    def remember(self, rows):
+        pass
+
+class LRUDeduplicator:
+    """Remembers the trace_ids of the last `size` stored events.
+
+    Kafka redeliveries after a crash or rebalance replay recent messages, so
+    they are caught here without a database round-trip. Anything older falls
+    through to INSERT ... ON DUPLICATE KEY UPDATE on the unique trace_id
+    index, so the cache only has to be fast, not complete.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()
+
+    def filter(self, rows):
+        """Drop rows whose trace_id was stored recently; returns (rows, number dropped)"""
+        with self._lock:
+            kept = [row for row in rows if row["trace_id"] not in self._seen]
+        return kept, len(rows) - len(kept)
+
+    def remember(self, rows):
+        """Record trace_ids once their rows are committed, evicting the oldest past size"""
+        with self._lock:
+            for row in rows:
+                self._seen[row["trace_id"]] = None
+                self._seen.move_to_end(row["trace_id"])
+            while len(self._seen) > self.size:
+                self._seen.popitem(last=False)
+
+def make_deduplicator(strategy, size):
+    """Build the deduplicator named in config"""
+    if strategy == "lru":
+        return LRUDeduplicator(size)
+    if strategy == "none":
+        return NoDeduplicator()
+    raise ValueError(f"Unknown dedup strategy: {strategy}")
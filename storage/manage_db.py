@@ -1,20 +1,25 @@
+import sys
 from sqlalchemy import create_engine
-from models import Base
+from models import Base, ensure_indexes
 
 SQLALCHEMY_DATABASE_URI = 'mysql://aron:password@db/database3855?charset=utf8mb4'
 
 # Create the SQLite engine
 engine = create_engine(SQLALCHEMY_DATABASE_URI)
 
-# Create all tables in the database
+# Create all tables in the database, and bring existing ones up to date (duplicate trace_ids removed, missing indexes built)
 def create_db():
     Base.metadata.create_all(engine)
+    for index_name in ensure_indexes(engine):
+        print(f"Created missing index {index_name}")
 
 # Drop all tables in the database
 def drop_db():
     Base.metadata.drop_all(engine)
 
 if __name__ == "__main__":
-    drop_db()
+    # `python manage_db.py migrate` upgrades the existing tables in place instead of recreating them empty
+    if sys.argv[1:] != ["migrate"]:
+        drop_db()
     create_db()
     
\ No newline at end of file
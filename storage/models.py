@@ -1,8 +1,12 @@
+import logging
 from sqlalchemy.orm import DeclarativeBase, mapped_column
-from sqlalchemy import Integer, String, DateTime, Float, func
-from sqlalchemy import create_engine
+from sqlalchemy import Integer, BigInteger, String, DateTime, Float, Index, func
+from sqlalchemy import create_engine, delete, inspect
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
 
+logger = logging.getLogger('basicLogger')
+
 # Base class for ORM models
 class Base(DeclarativeBase):
     pass
@@ -19,6 +23,12 @@ class PlayerEvent(Base):
     trace_id = mapped_column(String(255), nullable=False)
     date_created = mapped_column(DateTime, nullable=False, default=func.now())
 
+    __table_args__ = (
+        Index("ix_player_events_date_created_id", "date_created", "id"),
+        Index("ix_player_events_server_id_date_created", "server_id", "date_created"),
+        Index("ix_player_events_trace_id", "trace_id", unique=True),  # Redelivered events are ignored, not stored twice
+    )
+
 # Model for server events
 class ServerEvent(Base):
     __tablename__ = "server_events"
@@ -31,11 +41,90 @@ class ServerEvent(Base):
     trace_id = mapped_column(String(255), nullable=False)
     date_created = mapped_column(DateTime, nullable=False, default=func.now())
 
+    __table_args__ = (
+        Index("ix_server_events_date_created_id", "date_created", "id"),
+        Index("ix_server_events_server_id_date_created", "server_id", "date_created"),
+        Index("ix_server_events_trace_id", "trace_id", unique=True),  # Redelivered events are ignored, not stored twice
+    )
+
+# Per-minute rollup of player events, updated in the same transaction as the raw rows
+class PlayerEventRollup(Base):
+    __tablename__ = "player_event_rollups"
+    minute = mapped_column(DateTime, primary_key=True)
+    server_id = mapped_column(String(50), primary_key=True)
+    action = mapped_column(String(50), primary_key=True)
+    count = mapped_column(Integer, nullable=False)
+    score_sum = mapped_column(BigInteger, nullable=False)
+    score_min = mapped_column(Integer, nullable=False)
+    score_max = mapped_column(Integer, nullable=False)
+
+# Per-minute rollup of server events, updated in the same transaction as the raw rows
+class ServerEventRollup(Base):
+    __tablename__ = "server_event_rollups"
+    minute = mapped_column(DateTime, primary_key=True)
+    server_id = mapped_column(String(50), primary_key=True)
+    count = mapped_column(Integer, nullable=False)
+    cpu_usage_sum = mapped_column(Float, nullable=False)
+    cpu_usage_min = mapped_column(Float, nullable=False)
+    cpu_usage_max = mapped_column(Float, nullable=False)
+    memory_usage_sum = mapped_column(Float, nullable=False)
+    memory_usage_min = mapped_column(Float, nullable=False)
+    memory_usage_max = mapped_column(Float, nullable=False)
+
 SQLALCHEMY_DATABASE_URI = 'mysql://aron:password@db/database3855?charset=utf8mb4'
 
 # Database connection setup
 engine = create_engine(SQLALCHEMY_DATABASE_URI)
+Session = sessionmaker(bind=engine)
+
+def configure_engine(url, **pool_options):
+    """Replace the default engine with one whose connection pool is sized from config"""
+    global engine
+    engine = create_engine(url, **pool_options)
+    Session.configure(bind=engine)
+    return engine
+
+def index_names(engine, table):
+    return {index["name"] for index in inspect(engine).get_indexes(table.name)}
+
+def remove_duplicates(engine, table, columns):
+    """Delete rows that repeat the values of columns, keeping the one with the lowest id; returns the number deleted"""
+    kept = table.alias("kept")
+    statement = delete(table).where(
+        *(table.c[column.name] == kept.c[column.name] for column in columns),
+        table.c.id > kept.c.id
+    )
+    with engine.begin() as connection:
+        return connection.execute(statement).rowcount
+
+def ensure_indexes(engine):
+    """Create indexes the models declare but existing tables lack, since create_all only builds missing tables.
+
+    Before a unique index is built, rows stored more than once under it (e.g.
+    redeliveries from before the unique trace_id index existed) are deleted,
+    keeping the first copy. Raises RuntimeError if an index still can't be
+    built, so the service never runs without it. Returns the names of the
+    indexes created.
+    """
+    created = []
+    for table in Base.metadata.sorted_tables:
+        existing = index_names(engine, table)
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in existing:
+                continue
+            try:
+                if index.unique:
+                    removed = remove_duplicates(engine, table, index.columns)
+                    if removed:
+                        logger.warning(f"Deleted {removed} duplicate rows from {table.name} before creating {index.name}")
+                index.create(bind=engine)
+            except SQLAlchemyError as e:
+                if index.name in index_names(engine, table):
+                    continue  # Another replica built it first
+                raise RuntimeError(f"{table.name} is missing index {index.name} and it could not be created: {e}") from e
+            created.append(index.name)
+    return created
 
 # Session maker
 def make_session():
-    return sessionmaker(bind=engine)()
+    return Session()
@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+CachedResponse = namedtuple("CachedResponse", ["body", "headers", "expires"])
+
+class ResponseCache:
+    """Serialised responses for closed time windows, least recently used first out.
+
+    Rows only ever get a date_created of "now", so a window that ended in the
+    past never changes and its response can be replayed byte for byte. The
+    cache is bounded by the total size of the stored bodies, and entries also
+    expire after `ttl` seconds as a safety net.
+    """
+
+    def __init__(self, max_bytes, max_entry_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key):
+        """Return the cached response for key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, headers):
+        """Store a response body; bodies over max_entry_bytes are not cached"""
+        if len(body) > self.max_entry_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CachedResponse(body, dict(headers), time.monotonic() + self.ttl)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        return True
+
+    def _remove(self, key):
+        self._bytes -= len(self._entries.pop(key).body)
+
+    def size_bytes(self):
+        with self._lock:
+            return self._bytes
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
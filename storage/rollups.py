@@ -0,0 +1,95 @@
+from datetime import timezone
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from models import PlayerEvent, ServerEvent, PlayerEventRollup, ServerEventRollup
+
+
+# Rollup model, the columns each minute is keyed on, and the columns summarised, per event model
+ROLLUPS = {
+    PlayerEvent: (PlayerEventRollup, ("server_id", "action"), ("score",)),
+    ServerEvent: (ServerEventRollup, ("server_id",), ("cpu_usage", "memory_usage"))
+}
+
+# MySQL DATE_FORMAT patterns truncating a minute to the start of its bucket
+GRANULARITIES = {"1m": "%Y-%m-%d %H:%i:00", "1h": "%Y-%m-%d %H:00:00", "1d": "%Y-%m-%d 00:00:00"}
+
+class RollupConflict(Exception):
+    """Another writer stored some of the batch between the duplicate check and the insert"""
+
+def to_minute(moment):
+    """Naive UTC start of the minute an event timestamp falls in"""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.replace(second=0, microsecond=0)
+
+def unstored_rows(session, model, rows):
+    """Rows whose trace_id is neither stored yet nor repeated earlier in the batch"""
+    stored = set(session.scalars(select(model.trace_id).where(model.trace_id.in_({row["trace_id"] for row in rows}))))
+    new_rows = []
+    for row in rows:
+        if row["trace_id"] not in stored:
+            stored.add(row["trace_id"])
+            new_rows.append(row)
+    return new_rows
+
+def summarise(model, rows):
+    """Fold rows into one rollup row per minute and key, in primary key order"""
+    _, keys, fields = ROLLUPS[model]
+    buckets = {}
+
+    for row in rows:
+        key = (to_minute(row["timestamp"]),) + tuple(row[column] for column in keys)
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = {"minute": key[0], **{column: row[column] for column in keys}, "count": 0}
+            for field in fields:
+                bucket.update({f"{field}_sum": 0, f"{field}_min": row[field], f"{field}_max": row[field]})
+        bucket["count"] += 1
+        for field in fields:
+            bucket[f"{field}_sum"] += row[field]
+            bucket[f"{field}_min"] = min(bucket[f"{field}_min"], row[field])
+            bucket[f"{field}_max"] = max(bucket[f"{field}_max"], row[field])
+
+    # A fixed lock order keeps workers updating the same minutes from deadlocking
+    return [buckets[key] for key in sorted(buckets)]
+
+def upsert_rollups(session, model, rows):
+    """Add rows to their minutes' rollups with INSERT ... ON DUPLICATE KEY UPDATE, in the caller's transaction"""
+    summaries = summarise(model, rows)
+    if not summaries:
+        return
+
+    rollup, _, fields = ROLLUPS[model]
+    stmt = mysql_insert(rollup)
+    updates = {"count": rollup.count + stmt.inserted.count}
+    for field in fields:
+        updates[f"{field}_sum"] = getattr(rollup, f"{field}_sum") + getattr(stmt.inserted, f"{field}_sum")
+        updates[f"{field}_min"] = func.least(getattr(rollup, f"{field}_min"), getattr(stmt.inserted, f"{field}_min"))
+        updates[f"{field}_max"] = func.greatest(getattr(rollup, f"{field}_max"), getattr(stmt.inserted, f"{field}_max"))
+    session.execute(stmt.on_duplicate_key_update(**updates), summaries)
+
+def query_rollups(session, model, granularity, start, end, group_by=None):
+    """Rollup buckets of the given granularity for minutes in [start, end), optionally split by a key column"""
+    rollup, _, fields = ROLLUPS[model]
+    # Inlined rather than bound, so MySQL sees the GROUP BY expression as the selected one
+    bucket = func.date_format(rollup.minute, literal_column(f"'{GRANULARITIES[granularity]}'")).label("bucket")
+    columns = [bucket] + ([getattr(rollup, group_by)] if group_by else []) + [func.sum(rollup.count).label("count")]
+    for field in fields:
+        columns += [func.sum(getattr(rollup, f"{field}_sum")).label(f"{field}_sum"),
+                    func.min(getattr(rollup, f"{field}_min")).label(f"{field}_min"),
+                    func.max(getattr(rollup, f"{field}_max")).label(f"{field}_max")]
+
+    group = [bucket] + ([getattr(rollup, group_by)] if group_by else [])
+    stmt = select(*columns).where(rollup.minute >= start, rollup.minute < end).group_by(*group).order_by(*group)
+
+    buckets = []
+    for row in session.execute(stmt):
+        entry = {"start": row.bucket.replace(" ", "T"), "count": int(row.count)}
+        if group_by:
+            entry[group_by] = getattr(row, group_by)
+        for field in fields:
+            total = getattr(row, f"{field}_sum")
+            entry[field] = {"sum": float(total), "min": getattr(row, f"{field}_min"),
+                            "max": getattr(row, f"{field}_max"), "avg": float(total) / int(row.count)}
+        buckets.append(entry)
+    return buckets